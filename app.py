@@ -6,21 +6,94 @@ import datetime
 import uuid
 import psutil
 import sqlite3
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, g, make_response
 from flask_cors import CORS
 from flask_socketio import SocketIO
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import paho.mqtt.client as mqtt
-import paho.mqtt.publish as publish
 import secrets
-from database import db, User, SimCard, Message, Log, init_db, SmsStatus
+from database import (
+    db, User, SimCard, Message, Log, init_db, SmsStatus, configure_storage, register_session_metrics
+)
+from mqtt_publisher import MqttPublisher
+from send_queue import SendDispatcher
+from mqtt_workers import MessageWorkerPool, json_key
+from cluster import SocketRelay, default_instance_id, shared_topic
+from status_buffer import StatusBuffer
+from event_stream import EventBatcher
+from pagination import paginate, parse_limit
+from auth_cache import AuthCache
+from idempotency import IdempotencyStore
+from stats_sampler import StatisticsSampler
+from retention import RetentionManager, build_policies
+from tiering import MessageArchiver
+from sim_scheduler import SimScheduler
+from rate_limiter import RateShaper
+from metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from profiler import RequestProfiler, StackSampler
+from log_pipeline import configure_logging, get_logger, log_payload
+from rollups import (
+    RollupDeltas, record_message, get_message_totals, get_messages_per_day, get_messages_per_sim,
+    get_status_totals
+)
 
 # Load config
-with open('config.json') as f:
+with open(os.environ.get('GATEWAY_CONFIG', 'config.json')) as f:
     config = json.load(f)
     MQTT_HOST = config['MQTT']['host']
     MQTT_PORT = config['MQTT']['port']
+    MQTT_SUBSCRIBE_HOST = config['MQTT'].get('subscribe_host', 'localhost')
+    MQTT_PUBLISHER_POOL_SIZE = config['MQTT'].get('publisher_pool_size', 1)
+    MQTT_PUBLISH_TIMEOUT = config['MQTT'].get('publish_timeout', 10)
+    STATUS_BATCH_SIZE = config['MQTT'].get('status_batch_size', 100)
+    STATUS_FLUSH_INTERVAL_MS = config['MQTT'].get('status_flush_interval_ms', 200)
+    EVENT_WINDOW_MS = config.get('Events', {}).get('window_ms', 250)
+    ASYNC_SEND = config['SMS'].get('async_send', False)
+    BULK_MAX_SIZE = config['SMS'].get('bulk_max_size', 1000)
+    IDEMPOTENCY_MAX_KEYS = config['SMS'].get('idempotency_max_keys', 10000)
+    IDEMPOTENCY_TTL = config['SMS'].get('idempotency_ttl', 86400)
+    CLUSTER_ENABLED = config.get('Cluster', {}).get('enabled', False)
+    CLUSTER_SHARE_GROUP = config.get('Cluster', {}).get('share_group', 'sms-gateway')
+    CLUSTER_RELAY_TOPIC = config.get('Cluster', {}).get('relay_topic', 'gateway/socketio')
+    MQTT_WORKERS = config['MQTT'].get('workers', 4)
+    MQTT_WORKER_QUEUE_SIZE = config['MQTT'].get('worker_queue_size', 10000)
+    STATUS_DEDUPE_WINDOW = config['MQTT'].get('status_dedupe_window', 600)
+    STATUS_DEDUPE_SIZE = config['MQTT'].get('status_dedupe_size', 100000)
+    STATISTICS_INTERVAL = config.get('Statistics', {}).get('interval', 15)
+    AUTH_CACHE_SIZE = config['Security'].get('auth_cache_size', 1024)
+    AUTH_CACHE_TTL = config['Security'].get('auth_cache_ttl', 300)
+    AUTH_CACHE_NEGATIVE_TTL = config['Security'].get('auth_cache_negative_ttl', 30)
+    LOGGING_CONFIG = config.get('Logging', {})
+    RETENTION_INTERVAL = LOGGING_CONFIG.get('retention_interval', 300)
+    RETENTION_BATCH_SIZE = LOGGING_CONFIG.get('retention_batch_size', 500)
+    RETENTION_ARCHIVE_DIR = LOGGING_CONFIG.get('archive_dir')
+    RETENTION_VACUUM_PAGES = LOGGING_CONFIG.get('vacuum_pages', 2000)
+    SIM_STRATEGY = config.get('SimScheduler', {}).get('strategy', 'round_robin')
+    SIM_ROUTE_TO_SIM_TOPIC = config.get('SimScheduler', {}).get('route_to_sim_topic', True)
+    SIM_INFLIGHT_TIMEOUT = config.get('SimScheduler', {}).get('inflight_timeout', 300)
+    SIM_SYNC_INTERVAL = config.get('SimScheduler', {}).get('sync_interval', 60)
+    RATE_LIMIT_RATE = config.get('RateLimit', {}).get('messages_per_second')
+    RATE_LIMIT_BURST = config.get('RateLimit', {}).get('burst', 10)
+    RATE_LIMIT_HIGH_WATER = config.get('RateLimit', {}).get('high_water', 1000)
+    ARCHIVE_MAX_AGE_DAYS = config.get('Archive', {}).get('message_max_age_days')
+    ARCHIVE_DIR = config.get('Archive', {}).get('dir')
+    ARCHIVE_INTERVAL = config.get('Archive', {}).get('interval', 3600)
+    ARCHIVE_BATCH_SIZE = config.get('Archive', {}).get('batch_size', 1000)
+    METRICS_ENABLED = config.get('Metrics', {}).get('enabled', True)
+    METRICS_REQUIRE_API_KEY = config.get('Metrics', {}).get('require_api_key', True)
+    PROFILER_MAX_DURATION = config.get('Profiler', {}).get('max_duration', 600)
+
+# Structured logs are written to stdout by a background thread
+log_handler = configure_logging(LOGGING_CONFIG)
+logger = get_logger('api')
+mqtt_logger = get_logger('mqtt')
+
+# Cluster mode settings that differ per process come from the environment
+CLUSTER_ENABLED = os.environ.get('GATEWAY_CLUSTER', str(CLUSTER_ENABLED)).lower() in ('1', 'true', 'yes')
+INSTANCE_ID = os.environ.get('GATEWAY_INSTANCE_ID') or default_instance_id()
+# Only the primary instance runs jobs that must not run twice (recovery, retention, archiving)
+IS_PRIMARY = os.environ.get('GATEWAY_PRIMARY', 'true').lower() in ('1', 'true', 'yes')
 
 # Import eventlet and monkey patch
 import eventlet
@@ -39,7 +112,7 @@ socketio = SocketIO(app,
 )
 
 # Configure SQLite database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sms_gateway.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///sms_gateway.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,
@@ -47,6 +120,7 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_use_lifo': True
 }
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
+configure_storage(app, config.get('Database'))
 
 # Initialize database
 db.init_app(app)
@@ -55,27 +129,85 @@ init_db(app)
 import json
 import paho.mqtt.client as mqtt
 
+# Hot-path metrics exposed at /metrics; component counters are read at scrape time
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram(
+    'gateway_http_request_duration_seconds', 'Time spent handling HTTP requests', ['method', 'route']
+)
+http_requests = metrics.counter(
+    'gateway_http_requests_total', 'HTTP requests handled', ['method', 'route', 'status']
+)
+mqtt_publish_seconds = metrics.histogram(
+    'gateway_mqtt_publish_duration_seconds', 'Time from publishing a message to the broker acknowledgement'
+)
+mqtt_handler_seconds = metrics.histogram(
+    'gateway_mqtt_handler_duration_seconds', 'Time spent handling messages from /sms/status and /sms/receive',
+    ['handler']
+)
+db_seconds = metrics.histogram(
+    'gateway_db_duration_seconds', 'Time spent in database session flushes and commits', ['operation']
+)
+sim_messages = metrics.counter(
+    'gateway_sim_messages_total', 'Messages sent and received per SIM card id', ['sim', 'direction']
+)
+socketio_clients = metrics.gauge('gateway_socketio_clients', 'Connected Socket.IO clients')
+register_session_metrics(db_seconds)
+
+# Long-lived publisher shared by the send path and the status re-publish
+mqtt_publisher = MqttPublisher(
+    MQTT_HOST,
+    MQTT_PORT,
+    pool_size=MQTT_PUBLISHER_POOL_SIZE,
+    publish_timeout=MQTT_PUBLISH_TIMEOUT,
+    publish_seconds=mqtt_publish_seconds
+)
+mqtt_publisher.start()
+
+# In cluster mode dashboard frames are shared with the other instances
+socket_relay = None
+if CLUSTER_ENABLED:
+    socket_relay = SocketRelay(socketio, MQTT_SUBSCRIBE_HOST, MQTT_PORT, CLUSTER_RELAY_TOPIC, INSTANCE_ID)
+    socket_relay.start()
+
+# Dashboard updates are coalesced into one Socket.IO frame per window
+event_batcher = EventBatcher(socketio, window_ms=EVENT_WINDOW_MS, relay=socket_relay)
+event_batcher.start()
+
+# Status messages are written in batches off the MQTT network thread
+status_buffer = StatusBuffer(
+    app,
+    socketio,
+    event_batcher,
+    max_batch=STATUS_BATCH_SIZE,
+    flush_interval_ms=STATUS_FLUSH_INTERVAL_MS,
+    dedupe_window=STATUS_DEDUPE_WINDOW,
+    dedupe_size=STATUS_DEDUPE_SIZE
+)
+status_buffer.start()
+
 # MQTT Client setup with a message callback parameter
 def create_mqtt_client(topic, on_message_callback):
     mqtt_client = mqtt.Client()
 
+    # Instances in a cluster share the subscription; the broker hands each
+    # message to one of them
+    subscription = shared_topic(topic, CLUSTER_SHARE_GROUP) if CLUSTER_ENABLED else topic
+
     def on_connect(client, userdata, flags, rc):
-        print(f"Connected to MQTT broker with result code: {rc}")
-        print(f"Subscribing to topic: {topic}")
-        client.subscribe(topic)
-        print(f"Successfully subscribed to topic: {topic}")
+        mqtt_logger.info("Connected to MQTT broker, subscribing", extra={'rc': rc, 'topic': subscription})
+        client.subscribe(subscription)
 
     def on_message(client, userdata, msg):
+        # Runs on paho's network loop; the callback only hands the payload off
         try:
-            print(f"Received message on topic {msg.topic}")
             payload = msg.payload.decode()
-            print(f"Message payload: {payload}")
+            log_payload(mqtt_logger, "Received MQTT message", payload, topic=msg.topic)
             on_message_callback(payload)
         except Exception as e:
-            print(f"Error processing MQTT message: {str(e)}")
+            mqtt_logger.error("Error processing MQTT message: %s", e, extra={'topic': msg.topic})
 
     def on_disconnect(client, userdata, rc):
-        print(f"Disconnected from MQTT broker with result code: {rc}")
+        mqtt_logger.warning("Disconnected from MQTT broker", extra={'rc': rc, 'topic': subscription})
 
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
@@ -84,58 +216,37 @@ def create_mqtt_client(topic, on_message_callback):
     return mqtt_client
 
 
+@mqtt_handler_seconds.labels('status').time()
 def handle_sms_status_message(payload):
-    print("Received status message:", payload)
+    log_payload(mqtt_logger, "Received status message", payload)
+    fields = {}
     try:
         data = json.loads(payload)
-        print("Parsed status data:", data)
-        
-        with app.app_context():
-            try:
-                # Update the message status in the database
-                message = Message.query.filter_by(id=data.get('message_id')).first()
-                if message:
-                    print(f"Found message with ID: {message.id}, updating status to: {data['status']}")
-                    message.status = data['status']
-                    db.session.commit()
-                    print("Message status updated successfully")
-                else:
-                    print(f"No message found with ID: {data.get('message_id')}")
-                
-                # Create SMS status record
-                sms_status = SmsStatus(
-                    sender_number=data["sender_number"],
-                    receiver_number=data["receiver_number"],
-                    message=data["message"],
-                    status=data["status"]
-                )
-                db.session.add(sms_status)
-                db.session.commit()
-                
-                print("Saved status record:", sms_status.to_dict())
-                
-                # Emit socket event for status update
-                socketio.emit('sms_status_update', {
-                    'message_id': data.get('message_id'),
-                    'status': data['status'],
-                    'timestamp': datetime.datetime.now().isoformat()
-                })
-                
-                # Also emit the full status data
-                socketio.emit('mqtt_status', payload)
-                
-            except Exception as e:
-                db.session.rollback()
-                print(f"Error updating message status: {str(e)}")
-                raise
+        fields = {'message_id': data.get('message_id'), 'sim': data.get('sender_number')}
+        # Database writes and socket emits happen in the status buffer's flush
+        mqtt_logger.debug("Received status report", extra=dict(fields, status=data.get('status')))
+        if status_buffer.add(data, payload) and data.get('message_id'):
+            sim_scheduler.completed(data['message_id'], data['status'])
     except json.JSONDecodeError as json_error:
-        print(f"Invalid JSON payload: {str(json_error)}")
+        mqtt_logger.warning("Invalid JSON in status message: %s", json_error)
     except Exception as e:
-        print(f"Error processing status message: {str(e)}")
+        mqtt_logger.exception("Error processing status message: %s", e, extra=fields)
+
+# Status reports are handled in order per message id
+status_workers = MessageWorkerPool(
+    socketio,
+    handle_sms_status_message,
+    'status',
+    workers=MQTT_WORKERS,
+    max_queue=MQTT_WORKER_QUEUE_SIZE,
+    key=json_key('message_id')
+)
+status_workers.start()
 
 # Create client and pass callback
-mqtt_client = create_mqtt_client('/sms/status',handle_sms_status_message)
+mqtt_client = create_mqtt_client('/sms/status', status_workers.submit)
 
+@mqtt_handler_seconds.labels('receive').time()
 def handle_sms_receive_message(payload):
     try:
         # Parse the incoming payload
@@ -144,7 +255,10 @@ def handle_sms_receive_message(payload):
         # Validate required fields
         required_fields = ['sender_number', 'receiver_number', 'message']
         if not all(field in data for field in required_fields):
-            print(f"Missing required fields in payload: {payload}")
+            mqtt_logger.warning(
+                "Missing required fields in received message",
+                extra={'missing': [field for field in required_fields if field not in data]}
+            )
             return
 
         sender_number = data['sender_number']
@@ -157,7 +271,7 @@ def handle_sms_receive_message(payload):
                 sim_card = SimCard.query.filter_by(number=sender_number).first()
                 
                 if not sim_card:
-                    print(f"No SIM card found for sender number: {sender_number}")
+                    mqtt_logger.info("Adding SIM card for unknown sender", extra={'sim': sender_number})
                     # Create a new SIM card entry if not found
                     sim_card = SimCard(
                         number=sender_number,
@@ -177,6 +291,7 @@ def handle_sms_receive_message(payload):
                 )
                 db.session.add(message)
                 db.session.flush()  # Get the message ID
+                record_message(message)
 
                 # Create a single log entry
                 log = Log(
@@ -192,20 +307,18 @@ def handle_sms_receive_message(payload):
                     sender_sim=sim_card.id
                 )
                 db.session.add(log)
+                db.session.flush()
+                message_row, log_row = message.to_api_dict(), log.to_dict()
                 
                 # Commit all changes in a single transaction
                 db.session.commit()
 
-                # Emit socket event with the complete message data
-                socketio.emit('sms_status_update', {
-                    'message_id': message.id,
-                    'recipient': receiver_number,
-                    'sender': sender_number,
-                    'message': message_text,
-                    'status': 'received',
-                    'timestamp': message.timestamp.isoformat(),
-                    'sim_card': sim_card.number
-                })
+                sim_messages.labels(sim_card.id, 'incoming').inc()
+
+                # Queue the new rows for the next dashboard update frame
+                event_batcher.message(message_row)
+                event_batcher.count('inbox')
+                stream_log(log_row)
 
                 # Publish status update for the received message
                 status_payload = {
@@ -215,43 +328,141 @@ def handle_sms_receive_message(payload):
                     'message': message_text,
                     'status': 'SUCCESS'
                 }
-                publish.single("sms/status", json.dumps(status_payload), hostname="localhost", port=1883)
+                mqtt_publisher.publish("sms/status", json.dumps(status_payload), qos=0, wait=False)
 
-                print(f"Successfully saved incoming message from {sender_number} to {receiver_number}")
-                print(f"Message ID: {message.id}, SIM Card: {sim_card.number}")
+                mqtt_logger.debug(
+                    "Saved incoming message", extra={'message_id': message.id, 'sim': sim_card.number}
+                )
 
             except Exception as db_error:
                 db.session.rollback()
-                print(f"Database error while saving message: {str(db_error)}")
+                mqtt_logger.error("Database error while saving message: %s", db_error, extra={'sim': sender_number})
                 raise
 
     except json.JSONDecodeError as json_error:
-        print(f"Invalid JSON payload: {str(json_error)}")
+        mqtt_logger.warning("Invalid JSON in received message: %s", json_error)
     except Exception as e:
-        print(f"Error processing received message: {str(e)}")
+        mqtt_logger.exception("Error processing received message: %s", e)
 
 
+# Incoming messages are handled in order per sender
+receive_workers = MessageWorkerPool(
+    socketio,
+    handle_sms_receive_message,
+    'receive',
+    workers=MQTT_WORKERS,
+    max_queue=MQTT_WORKER_QUEUE_SIZE,
+    key=json_key('sender_number')
+)
+receive_workers.start()
+
 # Create and connect client, subscribing to /sms/receive with the callback
-mqtt_client_receive_msg = create_mqtt_client('/sms/receive', handle_sms_receive_message)
-
-try:
-    print("Attempting to connect to MQTT broker...")
-    mqtt_client_receive_msg.connect("localhost", 1883, 60)
-    mqtt_client_receive_msg.loop_start()
-    print("MQTT client started successfully")
-except Exception as e:
-    print(f"Failed to connect to MQTT broker: {str(e)}")
-
-try:
-    print("Attempting to connect to MQTT broker...")
-    mqtt_client.connect("localhost", 1883, 60)
-    mqtt_client.loop_start()
-    print("MQTT client started successfully")
-except Exception as e:
-    print(f"Failed to connect to MQTT broker: {str(e)}")
+mqtt_client_receive_msg = create_mqtt_client('/sms/receive', receive_workers.submit)
+
+for client in (mqtt_client_receive_msg, mqtt_client):
+    try:
+        client.connect(MQTT_SUBSCRIBE_HOST, MQTT_PORT, 60)
+        client.loop_start()
+    except Exception as e:
+        mqtt_logger.error("Failed to connect to MQTT broker at %s:%s: %s", MQTT_SUBSCRIBE_HOST, MQTT_PORT, e)
+
+# Messages over a SIM's rate limit wait here and then go to the dispatcher
+rate_shaper = RateShaper(
+    socketio,
+    lambda message_id, topic: send_dispatcher.enqueue(message_id, topic),
+    rate=RATE_LIMIT_RATE,
+    burst=RATE_LIMIT_BURST,
+    high_water=RATE_LIMIT_HIGH_WATER
+)
+rate_shaper.start()
+
+send_dispatcher = SendDispatcher(app, mqtt_publisher, socketio, event_batcher, shaper=rate_shaper)
+send_dispatcher.start(recover=IS_PRIMARY)
+
+def stream_log(log_row):
+    event_batcher.log(log_row)
+    event_batcher.count('logs')
+
+def is_async_send(data):
+    """Async mode is enabled globally in config or per request with ?async=true"""
+    requested = data.get('async', request.args.get('async'))
+    if requested is None:
+        return ASYNC_SEND
+    if isinstance(requested, str):
+        return requested.lower() in ('1', 'true', 'yes')
+    return bool(requested)
+
+def page_response(key, items, next_cursor, total):
+    response = {key: items, 'next_cursor': next_cursor}
+    if total is not None:
+        response['total'] = total
+    return response
+
+# Spreads unpinned messages over the active SIM cards
+sim_scheduler = SimScheduler(
+    app,
+    socketio,
+    strategy=SIM_STRATEGY,
+    inflight_timeout=SIM_INFLIGHT_TIMEOUT,
+    sync_interval=SIM_SYNC_INTERVAL
+)
+sim_scheduler.start()
 
 def get_next_available_sim():
-    return SimCard.query.filter_by(status='active').first()
+    """Pick the SIM card for an unpinned message using the configured strategy.
+
+    SIM cards whose hold queue is full are skipped.
+    """
+    for _ in range(len(sim_scheduler)):
+        sim_id = sim_scheduler.select()
+        if sim_id is None:
+            return None
+        if rate_shaper.is_full(sim_id):
+            continue
+        sim_card = db.session.get(SimCard, sim_id)
+        if sim_card and sim_card.status == 'active':
+            return sim_card
+        # Changed outside the SIM card endpoints; the next sync picks it up again
+        sim_scheduler.remove(sim_id)
+    return None
+
+def backpressure_response(sim_ids):
+    retry_after = rate_shaper.retry_after(sim_ids)
+    response = jsonify({
+        'error': 'Too many messages waiting to be sent, retry later',
+        'retry_after': retry_after
+    })
+    return response, 429, {'Retry-After': str(retry_after)}
+
+def send_topic(sim_card, pinned):
+    """MQTT topic for a message sent through ``sim_card``"""
+    if pinned or SIM_ROUTE_TO_SIM_TOPIC:
+        return f"sms/send/{sim_card.number.replace('+', '')}"
+    return "sms/send"
+
+# API key and JWT user lookups, invalidated when a key is rotated
+auth_cache = AuthCache(
+    max_size=AUTH_CACHE_SIZE,
+    ttl=AUTH_CACHE_TTL,
+    negative_ttl=AUTH_CACHE_NEGATIVE_TTL
+)
+if socket_relay:
+    socket_relay.on('invalidate_user', lambda data: auth_cache.invalidate_user(data['user_id']))
+
+def invalidate_user(user_id, *api_keys):
+    """Drop a user's cached credentials here and, in cluster mode, on the other instances"""
+    auth_cache.invalidate_user(user_id, *api_keys)
+    if socket_relay:
+        # Only the id is sent; the other instances drop every cached key of the user
+        socket_relay.publish('invalidate_user', {'user_id': user_id}, qos=1)
+
+def read_only(f):
+    """Serve the request from the read-only database connections"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.db_reader = True
+        return f(*args, **kwargs)
+    return decorated
 
 def require_api_key(f):
     @wraps(f)
@@ -260,13 +471,56 @@ def require_api_key(f):
         if not api_key:
             return jsonify({'message': 'API key is missing'}), 401
         
-        user = User.query.filter_by(api_key=api_key).first()
+        user = auth_cache.get_api_key(
+            api_key, lambda key: User.query.filter_by(api_key=key).first()
+        )
         if not user:
             return jsonify({'message': 'Invalid API key'}), 401
+        g.api_user = user
         
         return f(*args, **kwargs)
     return decorated
 
+# Responses to requests sent with an Idempotency-Key header
+idempotency_store = IdempotencyStore(max_size=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL)
+
+def idempotent(f):
+    """Replay the stored response when a request repeats its Idempotency-Key.
+
+    Must be applied inside ``require_api_key``; keys are scoped per user.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key must be at most 255 characters'}), 400
+
+        scoped_key = (g.api_user.id, request.path, key)
+        fingerprint = idempotency_store.fingerprint(request.get_data())
+        state, stored = idempotency_store.begin(scoped_key, fingerprint)
+        if state == 'replay':
+            body, status = stored
+            return jsonify(body), status, {'Idempotent-Replayed': 'true'}
+        if state == 'in_progress':
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        if state == 'mismatch':
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            idempotency_store.abandon(scoped_key)
+            raise
+        # Server errors and backpressure are worth retrying, so they are not kept
+        if response.status_code < 500 and response.status_code != 429 and response.is_json:
+            idempotency_store.complete(scoped_key, fingerprint, response.get_json(), response.status_code)
+        else:
+            idempotency_store.abandon(scoped_key)
+        return response
+    return decorated
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -277,7 +531,7 @@ def token_required(f):
         try:
             token = token.split(' ')[1]  # Remove 'Bearer ' prefix
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
+            current_user = auth_cache.get_user(data['user_id'], User.query.get)
             if not current_user:
                 return jsonify({'message': 'User not found'}), 401
         except:
@@ -286,6 +540,47 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def admin_required(f):
+    """Use below ``token_required``; rejects users without the admin role"""
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if current_user.role != 'admin':
+            return jsonify({'message': 'Admin role required'}), 403
+        return f(current_user, *args, **kwargs)
+    return decorated
+
+# On-demand profiling of live requests and thread stacks, driven by /api/profiler
+request_profiler = RequestProfiler()
+stack_sampler = StackSampler()
+profiler_logger = get_logger('profiler')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request_profiler.enabled:
+        g.profile = request_profiler.begin(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.teardown_request
+def finish_request_profile(exc=None):
+    request_profiler.end(g.pop('profile', None))
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_seconds.labels(request.method, route).observe(time.perf_counter() - started)
+        http_requests.labels(request.method, route, response.status_code).inc()
+    return response
+
+@socketio.on('connect')
+def on_socketio_connect(auth=None):
+    socketio_clients.inc()
+
+@socketio.on('disconnect')
+def on_socketio_disconnect(*args):
+    socketio_clients.dec()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -317,6 +612,7 @@ def auth():
     })
 
 @app.route('/api/sim-cards', methods=['GET'])
+@read_only
 @require_api_key
 def get_sim_cards():
     sim_cards = SimCard.query.all()
@@ -324,24 +620,39 @@ def get_sim_cards():
         'sim_cards': [{
             'id': sim.id,
             'number': sim.number,
-            'status': sim.status
+            'status': sim.status,
+            'weight': sim.weight
         } for sim in sim_cards]
     })
 
+def parse_weight(value):
+    """SIM card weight from a request body; raises ``ValueError`` unless it is a positive integer"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError('weight must be a positive integer')
+    return value
+
 @app.route('/api/sim-cards', methods=['POST'])
 @require_api_key
 def add_sim_card():
     data = request.get_json()
     if not data or not data.get('number'):
         return jsonify({'message': 'Phone number is required'}), 400
+    try:
+        weight = parse_weight(data.get('weight', 1))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     
     try:
         sim_card = SimCard(
             number=data['number'],
-            status=data.get('status', 'active')
+            status=data.get('status', 'active'),
+            weight=weight
         )
         db.session.add(sim_card)
         db.session.commit()
+        sim_scheduler.upsert(sim_card)
         
         log = Log(
             action='add_sim_card',
@@ -350,13 +661,15 @@ def add_sim_card():
         )
         db.session.add(log)
         db.session.commit()
+        stream_log(log.to_dict())
         
         return jsonify({
             'message': 'SIM card added successfully',
             'sim_card': {
                 'id': sim_card.id,
                 'number': sim_card.number,
-                'status': sim_card.status
+                'status': sim_card.status,
+                'weight': sim_card.weight
             }
         })
     except Exception as e:
@@ -373,14 +686,22 @@ def update_sim_card(sim_id):
     sim_card = SimCard.query.get(sim_id)
     if not sim_card:
         return jsonify({'message': 'SIM card not found'}), 404
+    if 'weight' in data:
+        try:
+            weight = parse_weight(data['weight'])
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
     
     try:
         if 'number' in data:
             sim_card.number = data['number']
         if 'status' in data:
             sim_card.status = data['status']
+        if 'weight' in data:
+            sim_card.weight = weight
         
         db.session.commit()
+        sim_scheduler.upsert(sim_card)
         
         log = Log(
             action='update_sim_card',
@@ -389,13 +710,15 @@ def update_sim_card(sim_id):
         )
         db.session.add(log)
         db.session.commit()
+        stream_log(log.to_dict())
         
         return jsonify({
             'message': 'SIM card updated successfully',
             'sim_card': {
                 'id': sim_card.id,
                 'number': sim_card.number,
-                'status': sim_card.status
+                'status': sim_card.status,
+                'weight': sim_card.weight
             }
         })
     except Exception as e:
@@ -412,6 +735,7 @@ def delete_sim_card(sim_id):
     try:
         db.session.delete(sim_card)
         db.session.commit()
+        sim_scheduler.remove(sim_id)
         
         log = Log(
             action='delete_sim_card',
@@ -420,6 +744,7 @@ def delete_sim_card(sim_id):
         )
         db.session.add(log)
         db.session.commit()
+        stream_log(log.to_dict())
         
         return jsonify({'message': 'SIM card deleted successfully'})
     except Exception as e:
@@ -428,30 +753,25 @@ def delete_sim_card(sim_id):
 
 @app.route('/api/sms', methods=['POST'])
 @require_api_key
+@idempotent
 def send_sms():
     try:
-        print("Received SMS send request")
         data = request.get_json()
         if not data:
-            print("No data provided in request")
             return jsonify({'error': 'No data provided'}), 400
 
         # Validate required fields
         if not data.get('recipient'):
-            print("Missing recipient in request")
             return jsonify({'error': 'Recipient phone number is required'}), 400
         if not data.get('message'):
-            print("Missing message in request")
             return jsonify({'error': 'Message content is required'}), 400
 
         recipient = data['recipient']
         message_text = data['message']
         sim_card_id = data.get('sim_card_id')
-        print(f"Processing SMS to {recipient} with sim_card_id: {sim_card_id}")
 
         # Validate phone number format
         if not recipient.startswith('+'):
-            print(f"Invalid phone number format: {recipient}")
             return jsonify({'error': 'Phone number must start with + and include country code'}), 400
 
         # Get SIM card
@@ -459,51 +779,40 @@ def send_sms():
         if sim_card_id:
             sim_card = SimCard.query.get(sim_card_id)
             if not sim_card:
-                print(f"No SIM card found with ID: {sim_card_id}")
                 return jsonify({'error': f'No SIM card found with ID: {sim_card_id}'}), 400
             if sim_card.status != 'active':
-                print(f"SIM card {sim_card_id} is not active")
                 return jsonify({'error': f'SIM card {sim_card_id} is not active'}), 400
+            if rate_shaper.is_full(sim_card.id):
+                return backpressure_response([sim_card.id])
         else:
             sim_card = get_next_available_sim()
             if not sim_card:
-                print("No active SIM cards available")
+                active_ids = sim_scheduler.active_ids()
+                if active_ids:
+                    # Every active SIM has a full hold queue
+                    return backpressure_response(active_ids)
+                logger.warning("No active SIM cards available")
                 return jsonify({'error': 'No active SIM cards available'}), 400
 
-        print(f"Using SIM card: {sim_card.number}")
+        # Over the SIM's rate limit the message is held and sent later
+        held = not rate_shaper.acquire(sim_card.id)
+        async_send = is_async_send(data) or held
 
         # Create message record
         message = Message(
             recipient=recipient,
             message=message_text,
-            status='pending',
+            status='queued' if async_send else 'pending',
             direction='outgoing',
             sender_sim=sim_card.id
         )
         db.session.add(message)
         db.session.flush()  # ensure defaults like id and timestamp are generated
-        print(f"Created message record with ID: {message.id}")
+        record_message(message)
+        sim_card.last_used = message.timestamp
 
-        print(f"Publishing message to MQTT broker at {MQTT_HOST}:{MQTT_PORT}")
-        try:
-            message_dict = message.to_dict()
-            print(f"Message content: {message_dict}")
-            
-            # Choose MQTT topic based on whether sim_card_id is provided
-            mqtt_topic = "sms/send" if not sim_card_id else f"sms/send/{sim_card.number.replace('+', '')}"
-            
-            publish.single(
-                mqtt_topic, 
-                json.dumps(message_dict), 
-                hostname=MQTT_HOST, 
-                port=MQTT_PORT,
-                keepalive=60,
-                qos=1
-            )
-            print(f"Message published successfully to topic: {mqtt_topic}")
-        except Exception as e:
-            print(f"Failed to publish message: {str(e)}")
-            raise
+        # Choose MQTT topic based on whether sim_card_id is provided
+        mqtt_topic = send_topic(sim_card, pinned=bool(sim_card_id))
 
         # Create log details
         log_details = {
@@ -517,70 +826,361 @@ def send_sms():
         log = Log(
             action='send_sms',
             details=json.dumps(log_details, ensure_ascii=False),
-            status='pending',
+            status=message.status,
             sender_sim=sim_card.id
         )
         db.session.add(log)
-        
-        # Commit both message and log
-        db.session.commit()
+        db.session.flush()
+        message_row, log_row = message.to_api_dict(), log.to_dict()
+        message_id, message_dict, message_time = message.id, message.to_dict(), message.timestamp
+        sim_id, sim_number = sim_card.id, sim_card.number
 
-        # Emit socket event
-        socketio.emit('sms_status_update', {
-            'message_id': message.id,
-            'recipient': recipient,
-            'status': 'pending'
-        })
+        # Commit both message and log before publishing: the single writer
+        # connection must not wait on the broker
+        db.session.commit()
+        sim_messages.labels(sim_id, 'outgoing').inc()
+
+        if async_send:
+            # The dispatcher publishes the message and moves it to 'pending'
+            sim_scheduler.assigned(message_id, sim_id)
+            event_batcher.message(message_row)
+            event_batcher.count('outbox')
+            stream_log(log_row)
+            if held:
+                rate_shaper.hold(sim_id, message_id, mqtt_topic)
+            else:
+                send_dispatcher.enqueue(message_id, mqtt_topic)
+            return jsonify({
+                'message': 'SMS accepted for sending',
+                'message_id': message_id,
+                'sender_sim': sim_number,
+                'status': 'queued'
+            }), 202
+
+        log_payload(logger, "Publishing message", message_dict, message_id=message_id, sim=sim_number)
+        try:
+            mqtt_publisher.publish(mqtt_topic, json.dumps(message_dict), qos=1)
+        except Exception as e:
+            logger.error(
+                "Failed to publish message: %s", e,
+                extra={'message_id': message_id, 'sim': sim_number, 'topic': mqtt_topic}
+            )
+            mark_publish_failed([dict(message_row, timestamp=message_time)], [log_row])
+            event_batcher.message(dict(message_row, status='failed'))
+            event_batcher.count('outbox')
+            stream_log(log_row)
+            return jsonify({'error': f'Failed to send SMS: {str(e)}', 'message_id': message_id}), 500
+        logger.debug("Published message", extra={'message_id': message_id, 'sim': sim_number, 'topic': mqtt_topic})
+
+        sim_scheduler.assigned(message_id, sim_id)
+        event_batcher.message(message_row)
+        event_batcher.count('outbox')
+        stream_log(log_row)
 
         return jsonify({
             'message': 'SMS queued for sending',
-            'message_id': message.id,
-            'sender_sim': sim_card.number
+            'message_id': message_id,
+            'sender_sim': sim_number
         })
 
     except Exception as e:
         db.session.rollback()
-        print(f"Error in send_sms: {str(e)}")  # Add logging
+        logger.exception("Error in send_sms: %s", e)
+        return jsonify({'error': f'Failed to send SMS: {str(e)}'}), 500
+
+def mark_publish_failed(message_rows, log_rows):
+    """Mark committed outgoing messages and their log entries as failed after a failed publish.
+
+    Updates the rows in place; ``timestamp`` in ``message_rows`` must be a datetime.
+    """
+    deltas = RollupDeltas()
+    for row in message_rows:
+        deltas.status_changed(row['timestamp'], 'outgoing', row['sender_sim'], row['status'], 'failed')
+        row['status'] = 'failed'
+    for row in log_rows:
+        row['status'] = 'failed'
+    db.session.execute(
+        db.update(Message).where(Message.id.in_([row['id'] for row in message_rows])).values(status='failed')
+    )
+    db.session.execute(db.update(Log).where(Log.id.in_([row['id'] for row in log_rows])).values(status='failed'))
+    deltas.apply()
+    db.session.commit()
+
+def expand_bulk_request(data):
+    """Turn a bulk request into a list of {recipient, message, sim_card_id} items.
+
+    Accepts either ``messages`` (a list of individual sends) or a ``message``
+    template with a ``recipients`` list. Recipients may be plain numbers or
+    objects with ``recipient`` and optional ``params`` for the template. The
+    template is rendered for every recipient; an item it cannot be rendered
+    for carries an ``error`` instead of a message.
+    """
+    if isinstance(data.get('messages'), list):
+        return [item if isinstance(item, dict) else {} for item in data['messages']]
+
+    template = data.get('message')
+    items = []
+    for entry in data.get('recipients') or []:
+        sim_card_id = data.get('sim_card_id')
+        if isinstance(entry, dict):
+            recipient = entry.get('recipient')
+            params = entry.get('params')
+            sim_card_id = entry.get('sim_card_id', sim_card_id)
+        else:
+            recipient, params = entry, None
+        item = {'recipient': recipient, 'message': template, 'sim_card_id': sim_card_id}
+        if isinstance(template, str):
+            try:
+                item['message'] = template.format(**(params or {}))
+            except KeyError as e:
+                item['error'] = f'Missing template parameter: {e.args[0]}'
+            except (IndexError, ValueError, TypeError) as e:
+                item['error'] = f'Invalid template or params: {e}'
+            if 'error' in item:
+                item['message'] = None
+                logger.warning("Failed to render template", extra={'recipient': recipient, 'error': item['error']})
+        items.append(item)
+    return items
+
+@app.route('/api/sms/bulk', methods=['POST'])
+@require_api_key
+@idempotent
+def send_sms_bulk():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        items = expand_bulk_request(data)
+        if not items:
+            return jsonify({'error': 'Either messages or message with recipients is required'}), 400
+        if len(items) > BULK_MAX_SIZE:
+            return jsonify({'error': f'At most {BULK_MAX_SIZE} messages per request'}), 400
+
+        async_send = is_async_send(data)
+
+        # Resolve all pinned SIM cards with one query
+        pinned_ids = {item.get('sim_card_id') for item in items if item.get('sim_card_id')}
+        sim_cards = {sim.id: sim for sim in SimCard.query.filter(SimCard.id.in_(pinned_ids))} if pinned_ids else {}
+
+        results = []
+        message_rows = []
+        topics = []
+        held_ids = set()
+        backpressure_ids = set()
+        now = datetime.datetime.utcnow()
+        for index, item in enumerate(items):
+            recipient = item.get('recipient')
+            message_text = item.get('message')
+            sim_card_id = item.get('sim_card_id')
+            result = {'index': index, 'recipient': recipient}
+            results.append(result)
+
+            if item.get('error'):
+                result['error'] = item['error']
+                continue
+            if not recipient:
+                result['error'] = 'Recipient phone number is required'
+                continue
+            if not message_text:
+                result['error'] = 'Message content is required'
+                continue
+            if not str(recipient).startswith('+'):
+                result['error'] = 'Phone number must start with + and include country code'
+                continue
+
+            if sim_card_id:
+                sim_card = sim_cards.get(sim_card_id)
+                if not sim_card:
+                    result['error'] = f'No SIM card found with ID: {sim_card_id}'
+                    continue
+                if sim_card.status != 'active':
+                    result['error'] = f'SIM card {sim_card_id} is not active'
+                    continue
+                if rate_shaper.is_full(sim_card.id):
+                    result['error'] = f'Too many messages waiting for SIM card {sim_card_id}'
+                    backpressure_ids.add(sim_card.id)
+                    continue
+            else:
+                sim_card = get_next_available_sim()
+                if not sim_card:
+                    active_ids = sim_scheduler.active_ids()
+                    if active_ids:
+                        result['error'] = 'Too many messages waiting on every SIM card'
+                        backpressure_ids.update(active_ids)
+                    else:
+                        result['error'] = 'No active SIM cards available'
+                    continue
+
+            message_id = str(uuid.uuid4())
+            if not rate_shaper.acquire(sim_card.id):
+                held_ids.add(message_id)
+            message_rows.append({
+                'id': message_id,
+                'recipient': recipient,
+                'message': message_text,
+                'status': 'queued' if async_send or message_id in held_ids else 'pending',
+                'direction': 'outgoing',
+                'sender_sim': sim_card.id,
+                'timestamp': now
+            })
+            topics.append(send_topic(sim_card, pinned=bool(sim_card_id)))
+            result.update({'message_id': message_id, 'sender_sim': sim_card.number})
+
+        if not message_rows:
+            if backpressure_ids:
+                return backpressure_response(backpressure_ids)
+            return jsonify({'error': 'No valid messages in request', 'results': results}), 400
+
+        db.session.execute(db.insert(Message), message_rows)
+
+        accepted = [result for result in results if 'message_id' in result]
+        log_rows = [{
+            'id': str(uuid.uuid4()),
+            'action': 'send_sms',
+            'details': json.dumps({
+                'recipient': row['recipient'],
+                'message_id': row['id'],
+                'sim_card': result['sender_sim'],
+                'message': row['message'][:100]
+            }, ensure_ascii=False),
+            'status': row['status'],
+            'sender_sim': row['sender_sim'],
+            'timestamp': now
+        } for result, row in zip(accepted, message_rows)]
+        db.session.execute(db.insert(Log), log_rows)
+
+        deltas = RollupDeltas()
+        for row in message_rows:
+            deltas.message_added(row['timestamp'], 'outgoing', row['sender_sim'], row['status'])
+        deltas.apply()
+
+        db.session.execute(db.update(SimCard), [
+            {'id': sim_id, 'last_used': now}
+            for sim_id in {row['sender_sim'] for row in message_rows}
+        ])
+
+        # Commit all messages and logs in a single transaction, before
+        # publishing: the single writer connection must not wait on the broker
+        db.session.commit()
+
+        if not async_send:
+            # Held messages are published later by the rate shaper
+            to_publish = [
+                (topic, row, log_row) for topic, row, log_row in zip(topics, message_rows, log_rows)
+                if row['id'] not in held_ids
+            ]
+            publish_results = mqtt_publisher.publish_many([
+                (topic, json.dumps({'number': row['recipient'], 'message': row['message'], 'message_id': row['id']}))
+                for topic, row, _ in to_publish
+            ], qos=1)
+            failed = []
+            for (_, row, log_row), error in zip(to_publish, publish_results):
+                if error is not None:
+                    failed.append((row, log_row))
+                    logger.error(
+                        "Failed to publish bulk message: %s", error,
+                        extra={'message_id': row['id'], 'sim': row['sender_sim']}
+                    )
+            if failed:
+                mark_publish_failed([row for row, _ in failed], [log_row for _, log_row in failed])
+
+        for result, row in zip(accepted, message_rows):
+            result['status'] = row['status']
+            if row['status'] == 'failed':
+                result['error'] = 'Failed to publish message'
+
+        for row in message_rows:
+            if row['status'] != 'failed':
+                sim_scheduler.assigned(row['id'], row['sender_sim'])
+        for row in message_rows:
+            sim_messages.labels(row['sender_sim'], 'outgoing').inc()
+
+        for topic, row in zip(topics, message_rows):
+            if row['id'] in held_ids:
+                rate_shaper.hold(row['sender_sim'], row['id'], topic)
+            elif async_send:
+                send_dispatcher.enqueue(row['id'], topic)
+
+        for row in message_rows:
+            event_batcher.message(Message(**row).to_api_dict())
+        for row in log_rows:
+            event_batcher.log(Log(**row).to_dict())
+        event_batcher.count('outbox', len(message_rows))
+        event_batcher.count('logs', len(log_rows))
+
+        sent = sum(1 for row in message_rows if row['status'] != 'failed')
+
+        return jsonify({
+            'message': f'{sent} of {len(items)} SMS queued for sending',
+            'accepted': sent,
+            'failed': len(items) - sent,
+            'results': results
+        }), 202 if async_send or held_ids else 200
+
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Error in send_sms_bulk: %s", e)
         return jsonify({'error': f'Failed to send SMS: {str(e)}'}), 500
 
 @app.route('/api/sms/inbox', methods=['GET'])
+@read_only
 @require_api_key
 def get_inbox():
     try:
-        messages = Message.query.filter_by(direction='incoming').order_by(Message.timestamp.desc()).all()
-        return jsonify({
-            'messages': [msg.to_dict() for msg in messages]
-        })
+        # Archive tiers are only read when the requested range reaches them
+        messages, next_cursor, total = message_archiver.paginate(
+            lambda session: session.query(Message).filter_by(direction='incoming'),
+            request.args,
+            filters={'status': Message.status, 'sim': Message.sender_sim}
+        )
+        return jsonify(page_response('messages', [msg.to_api_dict() for msg in messages], next_cursor, total))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error in get_inbox: {str(e)}")  # Add logging
+        logger.exception("Error in get_inbox: %s", e)
         return jsonify({'error': 'Failed to fetch inbox messages'}), 500
 
 @app.route('/api/sms/outbox', methods=['GET'])
+@read_only
 @require_api_key
 def get_outbox():
     try:
-        messages = Message.query.filter_by(direction='outgoing').order_by(Message.timestamp.desc()).all()
-        return jsonify({
-            'messages': [msg.to_dict() for msg in messages]
-        })
+        # Archive tiers are only read when the requested range reaches them
+        messages, next_cursor, total = message_archiver.paginate(
+            lambda session: session.query(Message).filter_by(direction='outgoing'),
+            request.args,
+            filters={'status': Message.status, 'sim': Message.sender_sim}
+        )
+        return jsonify(page_response('messages', [msg.to_api_dict() for msg in messages], next_cursor, total))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error in get_outbox: {str(e)}")  # Add logging
+        logger.exception("Error in get_outbox: %s", e)
         return jsonify({'error': 'Failed to fetch outbox messages'}), 500
 
 @app.route('/api/logs', methods=['GET'])
+@read_only
 @require_api_key
 def get_logs():
-    logs = Log.query.order_by(Log.timestamp.desc()).all()
-    return jsonify({
-        'logs': [log.to_dict() for log in logs]
-    })
+    try:
+        logs, next_cursor, total = paginate(
+            Log.query, Log.timestamp, Log.id, request.args,
+            filters={'status': Log.status, 'sim': Log.sender_sim, 'action': Log.action}
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page_response('logs', [log.to_dict() for log in logs], next_cursor, total))
+
 @app.route('/api/generate-api-key', methods=['POST'])
 @token_required
 def generate_api_key(current_user):
     try:
         api_key = secrets.token_hex(32)
-        current_user.api_key = api_key
+        User.query.filter_by(id=current_user.id).update({'api_key': api_key})
         db.session.commit()
+        # Drop the old key right away and any negative entry for the new one
+        invalidate_user(current_user.id, current_user.api_key, api_key)
         
         log = Log(
             action='generate_api_key',
@@ -589,6 +1189,7 @@ def generate_api_key(current_user):
         )
         db.session.add(log)
         db.session.commit()
+        stream_log(log.to_dict())
         
         return jsonify({'api_key': api_key})
     except Exception as e:
@@ -596,11 +1197,20 @@ def generate_api_key(current_user):
         return jsonify({'message': str(e)}), 500
 
 @app.route('/api/sms-status', methods=['GET'])
+@read_only
 @require_api_key
 def get_all_sms_statuses():
     try:
-        # Get all messages with their statuses
-        messages = SmsStatus.query.order_by(SmsStatus.timestamp.desc()).all()
+        query = SmsStatus.query
+        sim_id = request.args.get('sim')
+        if sim_id:
+            # Status records carry the SIM number rather than its id
+            sim_card = SimCard.query.get(sim_id)
+            query = query.filter(SmsStatus.sender_number == (sim_card.number if sim_card else sim_id))
+        messages, next_cursor, total = paginate(
+            query, SmsStatus.timestamp, SmsStatus.id, request.args,
+            filters={'status': SmsStatus.status}
+        )
         
         # Format the response
         statuses = []
@@ -615,13 +1225,59 @@ def get_all_sms_statuses():
             }
             statuses.append(status)
             
-        return jsonify({
-            'statuses': statuses
-        })
+        return jsonify(page_response('statuses', statuses, next_cursor, total))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error in get_all_sms_statuses: {str(e)}")
+        logger.exception("Error in get_all_sms_statuses: %s", e)
         return jsonify({'error': 'Failed to fetch SMS statuses'}), 500
 
+@app.route('/api/changes', methods=['GET'])
+@read_only
+@require_api_key
+def get_changes():
+    """Return messages, logs and status records created or updated after ``since``.
+
+    Every write stamps the row with a global change sequence. Pass the
+    returned ``resume_token`` as ``since`` on the next call to get only
+    what changed in between.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # The first `limit` changes overall are among the first `limit` of each table
+        changes = []
+        for kind, model, serialize in (
+            ('messages', Message, Message.to_api_dict),
+            ('logs', Log, Log.to_dict),
+            ('statuses', SmsStatus, SmsStatus.to_dict)
+        ):
+            rows = (
+                model.query.filter(model.change_seq > since)
+                .order_by(model.change_seq)
+                .limit(limit + 1)
+                .all()
+            )
+            changes.extend((row.change_seq, kind, row, serialize) for row in rows)
+        changes.sort(key=lambda change: change[0])
+
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        response = {'messages': [], 'logs': [], 'statuses': []}
+        for seq, kind, row, serialize in changes:
+            response[kind].append(dict(serialize(row), change_seq=seq))
+
+        response['resume_token'] = changes[-1][0] if changes else since
+        response['has_more'] = has_more
+        return jsonify(response)
+    except Exception as e:
+        logger.exception("Error in get_changes: %s", e)
+        return jsonify({'error': 'Failed to fetch changes'}), 500
+
 def get_system_memory_stats():
     """Get system memory statistics"""
     memory = psutil.virtual_memory()
@@ -644,7 +1300,7 @@ def get_database_file_size(db_path='instance/sms_gateway.db'):
             'last_updated': datetime.datetime.now().isoformat()
         }
     except Exception as e:
-        print(f"Error getting database size: {e}")
+        logger.error("Error getting database size: %s", e)
         return {
             'name': os.path.basename(db_path),
             'error': str(e),
@@ -680,41 +1336,29 @@ def get_component_memory_usage():
     return components
 
 def get_message_statistics():
-    """Get statistics about messages"""
+    """Get statistics about messages from the message_stat rollup"""
     try:
-        total_messages = Message.query.count()
-        incoming_messages = Message.query.filter_by(direction='incoming').count()
-        outgoing_messages = Message.query.filter_by(direction='outgoing').count()
-        
-        # Get messages for today
-        today = datetime.datetime.now().date()
-        messages_today = Message.query.filter(
-            db.func.date(Message.timestamp) == today
-        ).count()
-        
+        totals = get_message_totals()
+        incoming_messages = totals.get('incoming', 0)
+        outgoing_messages = totals.get('outgoing', 0)
+
+        # Rollup buckets are in UTC, like message timestamps
+        now = datetime.datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        messages_today = sum(get_message_totals(since=today).values())
+
         # Get messages per day for the last 7 days
-        seven_days_ago = datetime.datetime.now() - datetime.timedelta(days=7)
-        messages_per_day = db.session.query(
-            db.func.date(Message.timestamp).label('date'),
-            db.func.count(Message.id).label('count')
-        ).filter(Message.timestamp >= seven_days_ago)\
-         .group_by(db.func.date(Message.timestamp))\
-         .all()
-        
-        messages_per_day = [{
-            'date': day.date,
-            'count': day.count
-        } for day in messages_per_day]
+        messages_per_day = get_messages_per_day(now - datetime.timedelta(days=7))
         
         return {
-            'total_messages': total_messages,
+            'total_messages': incoming_messages + outgoing_messages,
             'incoming_messages': incoming_messages,
             'outgoing_messages': outgoing_messages,
             'messages_today': messages_today,
             'messages_per_day': messages_per_day
         }
     except Exception as e:
-        print(f"Error getting message statistics: {e}")
+        logger.error("Error getting message statistics: %s", e)
         return {
             'total_messages': 0,
             'incoming_messages': 0,
@@ -724,8 +1368,6 @@ def get_message_statistics():
         }
 
 
-from sqlalchemy import func, desc
-
 def get_sim_card_statistics():
     """Get statistics about SIM cards"""
     try:
@@ -734,21 +1376,16 @@ def get_sim_card_statistics():
         inactive_sims = SimCard.query.filter_by(status='inactive').count()
 
         # Get top 5 most used SIMs
-        results = (
-            db.session.query(
-                SimCard.number.label("number"),
-                func.count(Message.id).label("message_count")
-            )
-            .join(Message, SimCard.id == Message.sender_sim)
-            .group_by(SimCard.number)
-            .order_by(desc("message_count"))
-            .limit(5)
+        results = get_messages_per_sim(limit=5)
+        numbers = dict(
+            db.session.query(SimCard.id, SimCard.number)
+            .filter(SimCard.id.in_([r.sim_id for r in results]))
             .all()
-        )
+        ) if results else {}
 
         most_used_sims = [
-            {'number': r.number, 'message_count': r.message_count}
-            for r in results
+            {'number': numbers[r.sim_id], 'message_count': r.message_count}
+            for r in results if r.sim_id in numbers
         ]
 
         most_used_sim = most_used_sims[0] if most_used_sims else {'number': 'N/A', 'message_count': 0}
@@ -762,7 +1399,7 @@ def get_sim_card_statistics():
         }
 
     except Exception as e:
-        print(f"Error getting SIM card statistics: {e}")
+        logger.error("Error getting SIM card statistics: %s", e)
         return {
             'total_sims': 0,
             'active_sims': 0,
@@ -772,21 +1409,260 @@ def get_sim_card_statistics():
         }
 
 
+def collect_statistics():
+    """Build a full statistics snapshot; runs in the background sampler"""
+    g.db_reader = True
+    return {
+        'memory': get_system_memory_stats(),
+        'components': get_component_memory_usage(),
+        'database': get_database_file_size(),
+        'messages': get_message_statistics(),
+        'sim_cards': get_sim_card_statistics(),
+        'status_ingest': status_buffer.stats(),
+        'retention': retention_manager.stats(),
+        'archive': message_archiver.stats(),
+        'sim_scheduler': sim_scheduler.stats(),
+        'rate_limit': rate_shaper.stats(),
+        'idempotency': idempotency_store.stats(),
+        'cluster': socket_relay.stats() if socket_relay else {'instance_id': INSTANCE_ID},
+        'logging': log_handler.stats(),
+        'mqtt_workers': {
+            'status': status_workers.stats(),
+            'receive': receive_workers.stats()
+        }
+    }
+
+# Keeps the log and status tables within the limits from the Logging section
+retention_manager = RetentionManager(
+    app,
+    socketio,
+    build_policies(LOGGING_CONFIG),
+    interval=RETENTION_INTERVAL,
+    batch_size=RETENTION_BATCH_SIZE,
+    archive_dir=RETENTION_ARCHIVE_DIR,
+    vacuum_pages=RETENTION_VACUUM_PAGES
+)
+if IS_PRIMARY:
+    retention_manager.start()
+
+# Messages older than Archive.message_max_age_days move to per-month files
+message_archiver = MessageArchiver(
+    app,
+    socketio,
+    ARCHIVE_DIR or os.path.join(app.instance_path, 'archive'),
+    max_age_days=ARCHIVE_MAX_AGE_DAYS,
+    interval=ARCHIVE_INTERVAL,
+    batch_size=ARCHIVE_BATCH_SIZE
+)
+if ARCHIVE_MAX_AGE_DAYS is not None and IS_PRIMARY:
+    message_archiver.start()
+
+# One sampler serves every dashboard instead of recomputing per request
+statistics_sampler = StatisticsSampler(app, socketio, collect_statistics, interval=STATISTICS_INTERVAL)
+statistics_sampler.start()
+
+# Queue depths and counters the components already keep, read when /metrics is scraped
+metrics.counter_function(
+    'gateway_socketio_frames_total', 'Socket.IO update frames emitted, by origin',
+    lambda: {'local': event_batcher.frames_sent, 'relay': socket_relay.relayed if socket_relay else 0},
+    ['source']
+)
+metrics.gauge_function(
+    'gateway_mqtt_worker_queue_depth', 'MQTT messages waiting for a worker',
+    lambda: {'status': status_workers.depth(), 'receive': receive_workers.depth()}, ['pool']
+)
+metrics.counter_function(
+    'gateway_mqtt_worker_dropped_total', 'MQTT messages dropped because the worker queues were full',
+    lambda: {'status': status_workers.dropped, 'receive': receive_workers.dropped}, ['pool']
+)
+metrics.gauge_function(
+    'gateway_status_buffer_pending', 'Status messages waiting for the next batch write',
+    lambda: status_buffer.stats()['pending']
+)
+metrics.gauge_function(
+    'gateway_mqtt_publisher_inflight', 'Published messages not yet acknowledged by the broker',
+    lambda: mqtt_publisher.stats()['inflight']
+)
+metrics.counter_function(
+    'gateway_mqtt_publish_failures_total', 'Publishes that failed or timed out',
+    lambda: mqtt_publisher.stats()['failed']
+)
+metrics.counter_function(
+    'gateway_log_records_dropped_total', 'Log records dropped because the log queue was full',
+    lambda: log_handler.dropped
+)
+metrics.gauge_function('gateway_send_queue_depth', 'Messages waiting for the send dispatcher', send_dispatcher.depth)
+metrics.gauge_function('gateway_rate_limit_held', 'Messages held by the per-SIM rate limit', rate_shaper.depth)
+metrics.gauge_function(
+    'gateway_process_resident_memory_bytes', 'Resident memory of the gateway process',
+    lambda: psutil.Process().memory_info().rss
+)
+
+def get_metrics():
+    """Expose the metrics registry in the Prometheus text format"""
+    return app.response_class(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+if METRICS_ENABLED:
+    app.add_url_rule(
+        '/metrics', 'get_metrics', require_api_key(get_metrics) if METRICS_REQUIRE_API_KEY else get_metrics
+    )
+
+def parse_number(value, name, default, minimum, maximum, cast=float):
+    """Read a numeric request field, raising ``ValueError`` outside [minimum, maximum]"""
+    if value is None:
+        return default
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if not minimum <= number <= maximum:
+        raise ValueError(f'{name} must be between {minimum} and {maximum}')
+    return number
+
+@app.route('/api/profiler', methods=['GET'])
+@token_required
+@admin_required
+def get_profiler_status(current_user):
+    """Report the state of the request profiler and the stack sampler"""
+    return jsonify({'requests': request_profiler.stats(), 'sampler': stack_sampler.stats()})
+
+@app.route('/api/profiler/requests', methods=['POST'])
+@token_required
+@admin_required
+def start_request_profiling(current_user):
+    """Profile a share of requests, optionally for one route and a fixed number of requests"""
+    data = request.get_json(silent=True) or {}
+    try:
+        sample_rate = parse_number(data.get('sample_rate'), 'sample_rate', 1.0, 0.0001, 1.0)
+        count = parse_number(data.get('count'), 'count', None, 1, 1000000, cast=int)
+        duration = parse_number(data.get('duration'), 'duration', 60, 1, PROFILER_MAX_DURATION)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    route = data.get('route')
+    if route and not any(rule.rule == route for rule in app.url_map.iter_rules()):
+        return jsonify({'error': f'Unknown route: {route}'}), 400
+
+    request_profiler.start(sample_rate=sample_rate, count=count, route=route, duration=duration)
+    profiler_logger.info(
+        "Request profiling started",
+        extra={'user': current_user.username, 'sample_rate': sample_rate, 'count': count, 'route': route}
+    )
+    return jsonify(request_profiler.stats())
+
+@app.route('/api/profiler/requests', methods=['DELETE'])
+@token_required
+@admin_required
+def stop_request_profiling(current_user):
+    request_profiler.stop()
+    return jsonify(request_profiler.stats())
+
+@app.route('/api/profiler/requests/stats', methods=['GET'])
+@token_required
+@admin_required
+def get_request_profile(current_user):
+    """Aggregated request profile as a pstats listing or a downloadable pstats file"""
+    route = request.args.get('route')
+    output = request.args.get('format', 'text')
+    if output == 'pstats':
+        data = request_profiler.dump(route)
+        if data is None:
+            return jsonify({'error': 'No profiled requests'}), 404
+        response = make_response(data)
+        response.headers['Content-Type'] = 'application/octet-stream'
+        response.headers['Content-Disposition'] = 'attachment; filename=requests.pstats'
+        return response
+    if output != 'text':
+        return jsonify({'error': 'format must be text or pstats'}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'), default=50, maximum=1000)
+        report = request_profiler.report(route, sort=request.args.get('sort', 'cumulative'), limit=limit)
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'Invalid sort or limit: {str(e)}'}), 400
+    if not report:
+        return jsonify({'error': 'No profiled requests'}), 404
+    response = make_response(report)
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    return response
+
+@app.route('/api/profiler/sampler', methods=['POST'])
+@token_required
+@admin_required
+def start_stack_sampling(current_user):
+    """Sample the stacks of every thread every ``interval_ms`` for ``duration`` seconds"""
+    data = request.get_json(silent=True) or {}
+    try:
+        interval_ms = parse_number(data.get('interval_ms'), 'interval_ms', 10, 1, 1000)
+        duration = parse_number(data.get('duration'), 'duration', 30, 1, PROFILER_MAX_DURATION)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    stack_sampler.start(interval=interval_ms / 1000.0, duration=duration)
+    profiler_logger.info(
+        "Stack sampling started",
+        extra={'user': current_user.username, 'interval_ms': interval_ms, 'duration': duration}
+    )
+    return jsonify(stack_sampler.stats())
+
+@app.route('/api/profiler/sampler', methods=['DELETE'])
+@token_required
+@admin_required
+def stop_stack_sampling(current_user):
+    stack_sampler.stop()
+    return jsonify(stack_sampler.stats())
+
+@app.route('/api/profiler/sampler/stacks', methods=['GET'])
+@token_required
+@admin_required
+def get_stack_samples(current_user):
+    """Sampled stacks in the collapsed flamegraph format, or the hottest frames as JSON"""
+    output = request.args.get('format', 'collapsed')
+    if output == 'json':
+        try:
+            limit = parse_limit(request.args.get('limit'), default=20, maximum=1000)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'sampler': stack_sampler.stats(), 'top': stack_sampler.top(limit)})
+    if output != 'collapsed':
+        return jsonify({'error': 'format must be collapsed or json'}), 400
+    response = make_response(stack_sampler.collapsed())
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    response.headers['Content-Disposition'] = 'attachment; filename=stacks.collapsed'
+    return response
+
 @app.route('/api/statistics', methods=['GET'])
+@read_only
 @require_api_key
 def get_statistics():
-    """Get system statistics including memory usage, database size, messages, and SIM cards"""
+    """Get the latest statistics snapshot including memory usage, database size, messages, and SIM cards"""
     try:
-        stats = {
-            'memory': get_system_memory_stats(),
-            'components': get_component_memory_usage(),
-            'database': get_database_file_size(),
-            'messages': get_message_statistics(),
-            'sim_cards': get_sim_card_statistics()
-        }
-        return jsonify(stats)
+        return jsonify(statistics_sampler.latest())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/summary', methods=['GET'])
+@read_only
+@require_api_key
+def get_summary():
+    """Get the counts and recent activity shown on the dashboard overview"""
+    try:
+        activity_limit = parse_limit(request.args.get('activity'), default=5, maximum=50)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Message counts come from the rollup; logs are bounded by retention
+        totals = get_message_totals()
+        recent_logs = Log.query.order_by(Log.timestamp.desc(), Log.id.desc()).limit(activity_limit).all()
+        return jsonify({
+            'inbox': totals.get('incoming', 0),
+            'outbox': totals.get('outgoing', 0),
+            'logs': db.session.query(db.func.count(Log.id)).scalar(),
+            'statuses': get_status_totals(),
+            'recent_activity': [log.to_dict() for log in recent_logs]
+        })
+    except Exception as e:
+        logger.exception("Error in get_summary: %s", e)
+        return jsonify({'error': 'Failed to fetch summary'}), 500
+
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=5001, debug=True)
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5001)), debug=True)
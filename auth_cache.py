@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+UserIdentity = namedtuple('UserIdentity', ['id', 'username', 'role', 'api_key'])
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=_MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl):
+        """Store ``value`` unless the key holds an unexpired entry; returns True if stored"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+            self._data[key] = (value, now + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        """Drop every entry whose value matches ``predicate``"""
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class AuthCache:
+    """Caches API key and JWT user lookups.
+
+    Unknown API keys are cached as ``None`` for ``negative_ttl`` seconds so
+    repeated attempts with invalid keys do not reach the database.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, negative_ttl=30):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._api_keys = TTLCache(max_size)
+        self._users = TTLCache(max_size)
+
+    @staticmethod
+    def identity(user):
+        return UserIdentity(user.id, user.username, user.role, user.api_key)
+
+    def get_api_key(self, api_key, loader):
+        """Return the identity for ``api_key`` or ``None`` if it is invalid.
+
+        ``loader`` is called with the key on a cache miss and must return a
+        ``User`` or ``None``.
+        """
+        identity = self._api_keys.get(api_key)
+        if identity is not _MISSING:
+            return identity
+        user = loader(api_key)
+        identity = self.identity(user) if user else None
+        self._api_keys.set(api_key, identity, self.ttl if identity else self.negative_ttl)
+        if identity:
+            self._users.set(identity.id, identity, self.ttl)
+        return identity
+
+    def get_user(self, user_id, loader):
+        identity = self._users.get(user_id)
+        if identity is not _MISSING:
+            return identity
+        user = loader(user_id)
+        identity = self.identity(user) if user else None
+        self._users.set(user_id, identity, self.ttl if identity else self.negative_ttl)
+        return identity
+
+    def invalidate_user(self, user_id, *api_keys):
+        """Drop cached entries for a user, e.g. after its API key rotates.
+
+        Every cached key of the user is dropped; ``api_keys`` also clears
+        negative entries, e.g. for a new key tried before it was issued.
+        """
+        self._users.delete(user_id)
+        self._api_keys.delete_where(lambda identity: identity is not None and identity.id == user_id)
+        for api_key in api_keys:
+            if api_key:
+                self._api_keys.delete(api_key)
+
+    def stats(self):
+        return {
+            'api_keys': len(self._api_keys),
+            'users': len(self._users),
+            'hits': self._api_keys.hits + self._users.hits,
+            'misses': self._api_keys.misses + self._users.misses
+        }
@@ -0,0 +1,210 @@
+"""Minimal MQTT 3.1.1 broker used as a stand-in for mosquitto in benchmarks.
+
+It implements just what the gateway and the benchmark tools use: CONNECT,
+PUBLISH with QoS 0/1, SUBSCRIBE with ``+``/``#`` wildcards and ``$share``
+groups, UNSUBSCRIBE, PINGREQ and DISCONNECT. Nothing is retained or
+persisted and QoS 1 deliveries to subscribers are sent as QoS 0.
+
+    python bench/broker.py [port]
+"""
+import socket
+import struct
+import sys
+import threading
+
+
+def _read_exact(sock, n):
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError('closed')
+        buf += chunk
+    return buf
+
+
+def _read_packet(sock):
+    header = _read_exact(sock, 1)[0]
+    multiplier, length = 1, 0
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    return header, _read_exact(sock, length) if length else b''
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(header, body):
+    return bytes([header]) + _encode_length(len(body)) + body
+
+
+def _utf8(data):
+    return struct.pack('!H', len(data)) + data
+
+
+def topic_matches(pattern, topic):
+    """Whether subscription filter ``pattern`` matches ``topic``"""
+    if pattern.startswith('$share/'):
+        pattern = pattern.split('/', 2)[2]
+    p_parts, t_parts = pattern.split('/'), topic.split('/')
+    for i, part in enumerate(p_parts):
+        if part == '#':
+            return True
+        if i >= len(t_parts):
+            return False
+        if part != '+' and part != t_parts[i]:
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+class Broker:
+    """Routes publishes to subscribers, one thread per client connection.
+
+    ``port=0`` binds a free port; ``port`` holds the bound port once
+    ``start`` has returned. ``published`` counts the messages received.
+    """
+
+    def __init__(self, host='127.0.0.1', port=1883):
+        self.host = host
+        self.port = port
+        self.published = 0
+        self._lock = threading.Lock()
+        self._subs = {}  # conn -> set(patterns)
+        self._send_locks = {}
+        self._share_rr = {}
+        self._server = None
+
+    def start(self):
+        """Bind the listening socket and serve clients on a daemon thread"""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(128)
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            conns = list(self._subs)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        self.start()
+        threading.Event().wait()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _send(self, conn, data):
+        lock = self._send_locks.get(conn)
+        if lock is None:
+            return
+        with lock:
+            try:
+                conn.sendall(data)
+            except OSError:
+                pass
+
+    def _route(self, topic, payload):
+        frame = _packet(0x30, _utf8(topic.encode()) + payload)
+        with self._lock:
+            self.published += 1
+            targets = []
+            shared = {}
+            for conn, patterns in self._subs.items():
+                for pattern in patterns:
+                    if topic_matches(pattern, topic):
+                        if pattern.startswith('$share/'):
+                            group = pattern.split('/', 2)[1] + '|' + pattern
+                            shared.setdefault(group, []).append(conn)
+                        else:
+                            targets.append(conn)
+                        break
+            for group, members in shared.items():
+                index = self._share_rr.get(group, 0)
+                self._share_rr[group] = index + 1
+                targets.append(members[index % len(members)])
+        for conn in targets:
+            self._send(conn, frame)
+
+    def _handle(self, conn):
+        with self._lock:
+            self._subs[conn] = set()
+            self._send_locks[conn] = threading.Lock()
+        try:
+            while True:
+                header, body = _read_packet(conn)
+                kind = header >> 4
+                if kind == 1:  # CONNECT
+                    self._send(conn, _packet(0x20, b'\x00\x00'))
+                elif kind == 3:  # PUBLISH
+                    qos = (header >> 1) & 3
+                    tlen = struct.unpack('!H', body[:2])[0]
+                    topic = body[2:2 + tlen].decode()
+                    pos = 2 + tlen
+                    if qos:
+                        mid = body[pos:pos + 2]
+                        pos += 2
+                        self._send(conn, _packet(0x40, mid))
+                    self._route(topic, body[pos:])
+                elif kind == 8:  # SUBSCRIBE
+                    mid = body[:2]
+                    pos, codes = 2, b''
+                    while pos < len(body):
+                        tlen = struct.unpack('!H', body[pos:pos + 2])[0]
+                        pattern = body[pos + 2:pos + 2 + tlen].decode()
+                        pos += 3 + tlen
+                        with self._lock:
+                            self._subs[conn].add(pattern)
+                        codes += b'\x00'
+                    self._send(conn, _packet(0x90, mid + codes))
+                elif kind == 10:  # UNSUBSCRIBE
+                    pos = 2
+                    while pos < len(body):
+                        tlen = struct.unpack('!H', body[pos:pos + 2])[0]
+                        pattern = body[pos + 2:pos + 2 + tlen].decode()
+                        pos += 2 + tlen
+                        with self._lock:
+                            self._subs[conn].discard(pattern)
+                    self._send(conn, _packet(0xB0, body[:2]))
+                elif kind == 12:  # PINGREQ
+                    self._send(conn, _packet(0xD0, b''))
+                elif kind == 14:  # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._subs.pop(conn, None)
+                self._send_locks.pop(conn, None)
+            conn.close()
+
+
+if __name__ == '__main__':
+    Broker(port=int(sys.argv[1]) if len(sys.argv) > 1 else 1883).serve_forever()
@@ -0,0 +1,216 @@
+"""Simulated fleet of SIM devices for exercising the gateway without modems.
+
+Each device listens on ``sms/send/<number>`` (and the fleet shares
+``sms/send``), answers every message on ``/sms/status`` after a random
+delay, and can inject incoming messages on ``/sms/receive``. Failure,
+duplicate and silence rates make it possible to test how the gateway
+copes with unreliable devices. Run it against any broker:
+
+    python bench/devices.py --port 1883 --numbers +15550000001,+15550000002
+"""
+import argparse
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+SEND_TOPIC = 'sms/send'
+STATUS_TOPIC = '/sms/status'
+RECEIVE_TOPIC = '/sms/receive'
+INBOUND_PREFIX = 'sim inbound '
+
+
+class DeviceFleet:
+    """SIM devices sharing one MQTT connection.
+
+    Every message received is answered with ``delivered`` (or ``failed``
+    with probability ``failure_rate``) after a delay drawn uniformly from
+    ``delay``. With probability ``duplicate_rate`` the report is sent
+    twice, and with ``silent_rate`` not at all. ``report_sent`` adds a
+    ``sent`` report as soon as the message arrives. Arrival and reply
+    times are kept in ``received`` and ``replied`` keyed by message id.
+    """
+
+    def __init__(self, host, port, numbers, delay=(0.05, 0.5), failure_rate=0.0, duplicate_rate=0.0,
+                 silent_rate=0.0, report_sent=False, seed=None):
+        self.numbers = list(numbers)
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.duplicate_rate = duplicate_rate
+        self.silent_rate = silent_rate
+        self.report_sent = report_sent
+        self.random = random.Random(seed)
+        self.received = {}   # message_id -> (monotonic time, number)
+        self.replied = {}    # message_id -> (monotonic time, final status)
+        self.injected = {}   # inbound sequence number -> monotonic time
+        self.silent = set()
+        self.counters = {'received': 0, 'invalid': 0, 'statuses': 0, 'duplicates': 0, 'injected': 0}
+        self._inbound_seq = itertools.count(1)
+        self._schedule = []
+        self._schedule_seq = itertools.count()
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._running = False
+        self._inbound_rate = 0
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"device-fleet-{id(self):x}")
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self._host = host
+        self._port = port
+        self._connected = threading.Event()
+
+    def start(self, timeout=10):
+        self._running = True
+        threading.Thread(target=self._run_schedule, daemon=True).start()
+        self._client.connect(self._host, self._port)
+        self._client.loop_start()
+        if not self._connected.wait(timeout):
+            raise RuntimeError(f"Device fleet could not connect to {self._host}:{self._port}")
+        return self
+
+    def stop(self):
+        self._running = False
+        self._inbound_rate = 0
+        with self._cond:
+            self._cond.notify_all()
+        self._client.loop_stop()
+        self._client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        client.subscribe([(SEND_TOPIC, 1), (f"{SEND_TOPIC}/+", 1)])
+        self._connected.set()
+
+    def _on_message(self, client, userdata, msg):
+        now = time.monotonic()
+        try:
+            data = json.loads(msg.payload)
+            message_id = data['message_id']
+        except (ValueError, KeyError, TypeError):
+            with self._lock:
+                self.counters['invalid'] += 1
+            return
+        if msg.topic == SEND_TOPIC:
+            number = self.random.choice(self.numbers)
+        else:
+            number = '+' + msg.topic.rsplit('/', 1)[1]
+        report = {
+            'message_id': message_id,
+            'sender_number': number,
+            'receiver_number': data.get('number'),
+            'message': data.get('message', '')
+        }
+        with self._lock:
+            self.counters['received'] += 1
+            self.received.setdefault(message_id, (now, number))
+        if self.report_sent:
+            self._publish_status(dict(report, status='sent'))
+        if self.random.random() < self.silent_rate:
+            with self._lock:
+                self.silent.add(message_id)
+            return
+        final = dict(report, status='failed' if self.random.random() < self.failure_rate else 'delivered')
+        due = now + self.random.uniform(*self.delay)
+        self._at(due, self._reply, final)
+        if self.random.random() < self.duplicate_rate:
+            self._at(due + self.random.uniform(*self.delay), self._reply, final, True)
+
+    def _reply(self, report, duplicate=False):
+        self._publish_status(report)
+        with self._lock:
+            if duplicate:
+                self.counters['duplicates'] += 1
+            else:
+                self.replied.setdefault(report['message_id'], (time.monotonic(), report['status']))
+
+    def _publish_status(self, report):
+        self._client.publish(STATUS_TOPIC, json.dumps(report), qos=1)
+        with self._lock:
+            self.counters['statuses'] += 1
+
+    def inject(self):
+        """Publish one incoming message from a random device; returns its sequence number"""
+        seq = next(self._inbound_seq)
+        payload = {
+            'sender_number': self.random.choice(self.numbers),
+            'receiver_number': f"+1888{seq % 10000:07d}",
+            'message': f"{INBOUND_PREFIX}{seq}"
+        }
+        with self._lock:
+            self.injected[seq] = time.monotonic()
+            self.counters['injected'] += 1
+        self._client.publish(RECEIVE_TOPIC, json.dumps(payload), qos=1)
+        return seq
+
+    def start_inbound(self, rate):
+        """Inject ``rate`` incoming messages per second until ``stop_inbound``"""
+        self._inbound_rate = rate
+        if rate:
+            self._at(time.monotonic(), self._inbound_tick, time.monotonic())
+
+    def stop_inbound(self):
+        self._inbound_rate = 0
+
+    def _inbound_tick(self, due):
+        if not self._inbound_rate:
+            return
+        self.inject()
+        # Schedule from the planned time so the rate holds when the fleet lags
+        self._at(due + 1.0 / self._inbound_rate, self._inbound_tick, due + 1.0 / self._inbound_rate)
+
+    def _at(self, when, func, *args):
+        with self._cond:
+            heapq.heappush(self._schedule, (when, next(self._schedule_seq), func, args))
+            self._cond.notify()
+
+    def _run_schedule(self):
+        while self._running:
+            with self._cond:
+                while self._running and (not self._schedule or self._schedule[0][0] > time.monotonic()):
+                    timeout = self._schedule[0][0] - time.monotonic() if self._schedule else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                _, _, func, args = heapq.heappop(self._schedule)
+            func(*args)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, silent=len(self.silent), scheduled=len(self._schedule))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--numbers', required=True, help='comma separated SIM numbers, e.g. +15550000001')
+    parser.add_argument('--delay-min', type=float, default=0.05, help='seconds before a status report')
+    parser.add_argument('--delay-max', type=float, default=0.5)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--silent-rate', type=float, default=0.0)
+    parser.add_argument('--report-sent', action='store_true', help="report 'sent' before the final status")
+    parser.add_argument('--inbound-rate', type=float, default=0.0, help='incoming messages per second')
+    args = parser.parse_args()
+
+    fleet = DeviceFleet(
+        args.host, args.port, [n.strip() for n in args.numbers.split(',') if n.strip()],
+        delay=(args.delay_min, args.delay_max), failure_rate=args.failure_rate,
+        duplicate_rate=args.duplicate_rate, silent_rate=args.silent_rate, report_sent=args.report_sent
+    ).start()
+    fleet.start_inbound(args.inbound_rate)
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(fleet.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.stop()
+
+
+if __name__ == '__main__':
+    main()
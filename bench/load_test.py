@@ -0,0 +1,354 @@
+"""HTTP load benchmark for the gateway API.
+
+Starts the gateway against a fresh SQLite database in a temporary directory
+and the stand-in broker from ``broker.py``, seeds SIM cards and messages,
+then drives each scenario for ``--duration`` seconds with ``--concurrency``
+client threads. Latency percentiles and throughput per scenario are written
+to a JSON file so runs on different commits can be compared:
+
+    python bench/load_test.py --concurrency 16 --duration 10
+    python bench/load_test.py --compare bench/results/<commit>.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import requests
+
+from broker import Broker
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = 'test_api_key_123456'
+HEADERS = {'X-API-Key': API_KEY}
+
+_numbers = itertools.count(1)
+
+
+def _send(args):
+    n = next(_numbers)
+    return 'POST', '/api/sms', {'recipient': f"+1555{n:07d}", 'message': f"bench message {n}"}
+
+
+SCENARIOS = {
+    'send': _send,
+    'inbox': lambda args: ('GET', f"/api/sms/inbox?limit={args.page_size}", None),
+    'outbox': lambda args: ('GET', f"/api/sms/outbox?limit={args.page_size}", None),
+    'logs': lambda args: ('GET', '/api/logs', None),
+    'sms_status': lambda args: ('GET', f"/api/sms-status?limit={args.page_size}", None),
+    'summary': lambda args: ('GET', '/api/summary', None),
+    'statistics': lambda args: ('GET', '/api/statistics', None),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(values)))
+    return values[rank - 1]
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT, text=True
+        ).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def parse_override(text):
+    """``Section.key=value`` with a JSON value, e.g. ``SMS.async_send=true``"""
+    path, _, value = text.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return path.split('.'), value
+
+
+def gateway_config(broker_port, overrides):
+    with open(os.path.join(REPO_ROOT, 'config.json')) as f:
+        config = json.load(f)
+    config['MQTT'].update({'host': '127.0.0.1', 'port': broker_port, 'subscribe_host': '127.0.0.1'})
+    # Measure the API, not the per-SIM send budget or background archiving
+    config.setdefault('RateLimit', {})['messages_per_second'] = None
+    config.setdefault('Archive', {})['message_max_age_days'] = None
+    config.setdefault('Logging', {})['archive_dir'] = None
+    for path, value in overrides:
+        section = config
+        for key in path[:-1]:
+            section = section.setdefault(key, {})
+        section[path[-1]] = value
+    return config
+
+
+class Gateway:
+    """The gateway running in a subprocess with its own config and database"""
+
+    def __init__(self, workdir, config, port):
+        self.workdir = workdir
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.config_path = os.path.join(workdir, 'config.json')
+        self.log_path = os.path.join(workdir, 'gateway.log')
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+        self.process = None
+
+    def start(self, timeout):
+        env = dict(
+            os.environ,
+            GATEWAY_CONFIG=self.config_path,
+            DATABASE_URL=f"sqlite:///{os.path.join(self.workdir, 'gateway.db')}",
+            PYTHONUNBUFFERED='1'
+        )
+        # Run without the debug reloader, which would start a second copy
+        code = f"import app; app.socketio.run(app.app, host='127.0.0.1', port={self.port})"
+        self._log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', code], cwd=REPO_ROOT, env=env,
+            stdout=self._log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Gateway exited with code {self.process.returncode}:\n{self.log_tail()}")
+            try:
+                if requests.get(f"{self.url}/api/summary", headers=HEADERS, timeout=2).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"Gateway did not start within {timeout}s:\n{self.log_tail()}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.process:
+            self._log.close()
+
+    def log_tail(self, lines=30):
+        with open(self.log_path) as f:
+            return ''.join(f.readlines()[-lines:])
+
+
+def seed(gateway, broker_port, args):
+    """Create SIM cards, outgoing messages and incoming messages to page through"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    for i in range(args.sims):
+        response = session.post(f"{gateway.url}/api/sim-cards", json={'number': f"+1999000{i:04d}"})
+        response.raise_for_status()
+
+    remaining = args.seed
+    while remaining > 0:
+        batch = min(remaining, 1000)
+        response = session.post(f"{gateway.url}/api/sms/bulk", json={'messages': [
+            {'recipient': f"+1444{n:07d}", 'message': f"seed message {n}"} for n in range(batch)
+        ]})
+        response.raise_for_status()
+        remaining -= batch
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id='bench-seed')
+    client.connect('127.0.0.1', broker_port)
+    client.loop_start()
+    info = None
+    for n in range(args.seed):
+        payload = {'sender_number': f"+1333{n % 100:07d}", 'receiver_number': '+19990000000',
+                   'message': f"seed inbound {n}"}
+        info = client.publish('/sms/receive', json.dumps(payload), qos=1)
+    if info is not None:
+        info.wait_for_publish(args.startup_timeout)
+    client.loop_stop()
+    client.disconnect()
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        summary = session.get(f"{gateway.url}/api/summary").json()
+        if summary['inbox'] >= args.seed and summary['outbox'] >= args.seed:
+            return summary
+        time.sleep(0.2)
+    raise RuntimeError(f"Seeding did not finish: {summary}")
+
+
+def run_scenario(url, name, args):
+    """Drive one scenario with ``args.concurrency`` threads; returns its result dict"""
+    build = SCENARIOS[name]
+    samples = []
+    statuses = {}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.concurrency + 1)
+    window = {}
+
+    def worker():
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        latencies = []
+        codes = {}
+        start_gate.wait()
+        warmup_end, end = window['warmup_end'], window['end']
+        while time.perf_counter() < end:
+            method, path, body = build(args)
+            started = time.perf_counter()
+            try:
+                code = session.request(method, url + path, json=body, timeout=args.timeout).status_code
+            except requests.RequestException:
+                code = 'error'
+            finished = time.perf_counter()
+            if started >= warmup_end:
+                latencies.append(finished - started)
+                codes[code] = codes.get(code, 0) + 1
+        with lock:
+            samples.extend(latencies)
+            for code, count in codes.items():
+                statuses[code] = statuses.get(code, 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    window['warmup_end'] = time.perf_counter() + args.warmup
+    window['end'] = window['warmup_end'] + args.duration
+    start_gate.wait()
+    for thread in threads:
+        thread.join()
+
+    samples.sort()
+    ok = sum(count for code, count in statuses.items() if code != 'error' and 200 <= code < 300)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(samples),
+        'ok': ok,
+        'errors': len(samples) - ok,
+        'status_codes': {str(code): count for code, count in sorted(statuses.items(), key=str)},
+        'throughput_rps': round(len(samples) / args.duration, 2),
+        'latency_ms': {
+            'min': ms(samples[0] if samples else None),
+            'mean': ms(sum(samples) / len(samples) if samples else None),
+            'p50': ms(percentile(samples, 50)),
+            'p95': ms(percentile(samples, 95)),
+            'p99': ms(percentile(samples, 99)),
+            'max': ms(samples[-1] if samples else None)
+        }
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline['meta'].get('commit') or baseline_path}:")
+    print(f"{'scenario':<12} {'rps':>10} {'p50':>10} {'p95':>10} {'p99':>10}")
+    change = lambda new, old: f"{(new - old) / old * 100:+.1f}%" if new is not None and old else 'n/a'
+    for name, result in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        print(f"{name:<12} {change(result['throughput_rps'], before['throughput_rps']):>10}" + ''.join(
+            f" {change(result['latency_ms'][p], before['latency_ms'][p]):>10}" for p in ('p50', 'p95', 'p99')
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads per scenario')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--sims', type=int, default=4, help='SIM cards to create')
+    parser.add_argument('--seed', type=int, default=2000, help='incoming and outgoing messages to seed')
+    parser.add_argument('--page-size', type=int, default=50, help='limit used by the list scenarios')
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout in seconds')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a config.json setting for the run, e.g. SMS.async_send=true')
+    parser.add_argument('--output', help='result file (default bench/results/<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='print the change against an earlier result file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory with the database and log')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    overrides = [parse_override(text) for text in args.overrides]
+
+    commit, dirty = git_commit()
+    workdir = tempfile.mkdtemp(prefix='gateway-bench-')
+    broker = Broker(port=0).start()
+    gateway = Gateway(workdir, gateway_config(broker.port, overrides), free_port())
+    try:
+        gateway.start(args.startup_timeout)
+        seeded = seed(gateway, broker.port, args)
+        print(f"Gateway on {gateway.url}, broker on port {broker.port}, "
+              f"seeded {seeded['inbox']} incoming / {seeded['outbox']} outgoing messages")
+
+        results = {
+            'meta': {
+                'commit': commit,
+                'dirty': dirty,
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'warmup': args.warmup,
+                'sims': args.sims,
+                'seed': args.seed,
+                'page_size': args.page_size,
+                'overrides': args.overrides
+            },
+            'scenarios': {}
+        }
+        print(f"{'scenario':<12} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name in scenarios:
+            result = results['scenarios'][name] = run_scenario(gateway.url, name, args)
+            latency = result['latency_ms']
+            print(f"{name:<12} {result['requests']:>9} {result['errors']:>7} {result['throughput_rps']:>9} "
+                  f"{latency['p50']!s:>9} {latency['p95']!s:>9} {latency['p99']!s:>9}")
+        results['broker'] = {'published': broker.published}
+    finally:
+        gateway.stop()
+        broker.stop()
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(REPO_ROOT, 'bench', 'results', f"{(commit or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
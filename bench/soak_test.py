@@ -0,0 +1,369 @@
+"""End-to-end soak test of the MQTT round trip.
+
+Starts the gateway and the stand-in broker like ``load_test.py`` and
+attaches a simulated device fleet (``devices.py``). For ``--duration``
+seconds it sends messages through ``/api/sms`` at ``--send-rate`` and
+injects incoming messages at ``--inbound-rate``, then waits up to
+``--drain`` seconds for the last status reports. The change feed is
+followed to see when each message reaches its final status:
+
+    python bench/soak_test.py --duration 60 --send-rate 50 --inbound-rate 50 --failure-rate 0.02
+
+Reports latency histograms for each leg of the round trip, messages that
+never reached a device or never left ``pending``, and the rate at which
+the gateway stored incoming messages and final statuses once warmed up.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+from broker import Broker
+from devices import DeviceFleet, INBOUND_PREFIX
+from load_test import (
+    HEADERS, REPO_ROOT, Gateway, free_port, gateway_config, git_commit, parse_override, percentile
+)
+
+FINAL_STATUSES = ('delivered', 'failed')
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def latency_summary(samples):
+    """Percentiles and bucket counts for a list of durations in seconds"""
+    samples = sorted(samples)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    buckets = {}
+    index = 0
+    for bound in BUCKETS_MS:
+        count = 0
+        while index < len(samples) and samples[index] * 1000 <= bound:
+            count += 1
+            index += 1
+        buckets[f"le_{bound}"] = count
+    buckets['le_inf'] = len(samples) - index
+    return {
+        'count': len(samples),
+        'mean': ms(sum(samples) / len(samples) if samples else None),
+        'p50': ms(percentile(samples, 50)),
+        'p90': ms(percentile(samples, 90)),
+        'p95': ms(percentile(samples, 95)),
+        'p99': ms(percentile(samples, 99)),
+        'max': ms(samples[-1] if samples else None),
+        'histogram_ms': buckets
+    }
+
+
+class ChangeWatcher:
+    """Follows ``/api/changes`` and records when messages are first seen in each state"""
+
+    def __init__(self, url, interval):
+        self.url = url
+        self.interval = interval
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.since = 0
+        self.last_status = {}   # outgoing message id -> latest status
+        self.final_seen = {}    # outgoing message id -> monotonic time of the first final status
+        self.inbound_seen = {}  # fleet inbound sequence number -> monotonic time
+        self.errors = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        # Skip what happened before the run
+        while True:
+            page = self.session.get(f"{self.url}/api/changes", params={'since': self.since, 'limit': 1000}).json()
+            self.since = page['resume_token']
+            if not page['has_more']:
+                break
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while self._running:
+            try:
+                has_more = self.poll()
+            except (requests.RequestException, ValueError, KeyError):
+                self.errors += 1
+                has_more = False
+            if not has_more:
+                time.sleep(self.interval)
+
+    def poll(self):
+        page = self.session.get(f"{self.url}/api/changes", params={'since': self.since, 'limit': 1000}).json()
+        now = time.monotonic()
+        for message in page['messages']:
+            if message['direction'] == 'outgoing':
+                self.last_status[message['id']] = message['status']
+                if message['status'] in FINAL_STATUSES:
+                    self.final_seen.setdefault(message['id'], now)
+            elif message['message'].startswith(INBOUND_PREFIX):
+                seq = int(message['message'][len(INBOUND_PREFIX):])
+                self.inbound_seen.setdefault(seq, now)
+        self.since = page['resume_token']
+        return page['has_more']
+
+
+def run_senders(url, args, sent, end):
+    """Send at ``args.send_rate`` messages per second from ``args.concurrency`` threads until ``end``"""
+    numbers = itertools.count()
+    start = time.monotonic()
+    lock = threading.Lock()
+    failures = {}
+
+    def worker():
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        while True:
+            n = next(numbers)
+            due = start + n / args.send_rate
+            if due >= end:
+                return
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            started = time.monotonic()
+            try:
+                response = session.post(f"{url}/api/sms", json={
+                    'recipient': f"+1777{n:07d}", 'message': f"soak message {n}"
+                }, timeout=args.timeout)
+                code = response.status_code
+                message_id = response.json().get('message_id') if response.ok else None
+            except (requests.RequestException, ValueError):
+                code, message_id = 'error', None
+            finished = time.monotonic()
+            with lock:
+                if message_id:
+                    sent[message_id] = (started, finished)
+                else:
+                    failures[str(code)] = failures.get(str(code), 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    return threads, failures
+
+
+def sample_ingest(url, samples, end):
+    """Record stored incoming messages and outgoing messages with a final status once a second until ``end``"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    while time.monotonic() < end:
+        try:
+            summary = session.get(f"{url}/api/summary").json()
+            outgoing = summary['statuses'].get('outgoing', {})
+            samples.append((time.monotonic(), summary['inbox'], sum(outgoing.get(s, 0) for s in FINAL_STATUSES)))
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        time.sleep(1)
+
+
+def steady_rate(samples, column, skip):
+    """Rows per second between the first sample after ``skip`` and the last one"""
+    if not samples:
+        return None
+    start = samples[0][0] + skip
+    window = [sample for sample in samples if sample[0] >= start] or samples
+    first, last = window[0], window[-1]
+    if last[0] <= first[0]:
+        return None
+    return round((last[column] - first[column]) / (last[0] - first[0]), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=60, help='seconds of traffic')
+    parser.add_argument('--drain', type=float, default=15, help='seconds to wait for outstanding reports')
+    parser.add_argument('--send-rate', type=float, default=20, help='messages per second sent through the API')
+    parser.add_argument('--inbound-rate', type=float, default=20, help='incoming messages per second')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads sending through the API')
+    parser.add_argument('--sims', type=int, default=4, help='simulated SIM devices')
+    parser.add_argument('--delay-min', type=float, default=0.05, help='seconds before a device reports')
+    parser.add_argument('--delay-max', type=float, default=0.5)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of messages reported 'failed'")
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='share of reports sent twice')
+    parser.add_argument('--silent-rate', type=float, default=0.0, help='share of messages never reported')
+    parser.add_argument('--report-sent', action='store_true', help="devices report 'sent' before the final status")
+    parser.add_argument('--warmup', type=float, default=None,
+                        help='seconds excluded from the ingest rate (default a fifth of the duration)')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='seconds between change feed polls')
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout in seconds')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, help='random seed for the device fleet')
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a config.json setting for the run, e.g. MQTT.workers=8')
+    parser.add_argument('--output', help='result file (default bench/results/soak-<commit>.json)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory with the database and log')
+    args = parser.parse_args()
+    warmup = args.duration / 5 if args.warmup is None else args.warmup
+
+    commit, dirty = git_commit()
+    workdir = tempfile.mkdtemp(prefix='gateway-soak-')
+    broker = Broker(port=0).start()
+    gateway = Gateway(workdir, gateway_config(broker.port, [parse_override(t) for t in args.overrides]), free_port())
+    numbers = [f"+1999100{i:04d}" for i in range(args.sims)]
+    fleet = DeviceFleet(
+        '127.0.0.1', broker.port, numbers, delay=(args.delay_min, args.delay_max),
+        failure_rate=args.failure_rate, duplicate_rate=args.duplicate_rate,
+        silent_rate=args.silent_rate, report_sent=args.report_sent, seed=args.seed
+    )
+    try:
+        gateway.start(args.startup_timeout)
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        for number in numbers:
+            session.post(f"{gateway.url}/api/sim-cards", json={'number': number}).raise_for_status()
+        fleet.start()
+        watcher = ChangeWatcher(gateway.url, args.poll_interval)
+        watcher.start()
+        print(f"Gateway on {gateway.url}, broker on port {broker.port}, {args.sims} devices; "
+              f"sending {args.send_rate}/s and injecting {args.inbound_rate}/s for {args.duration}s")
+
+        sent = {}
+        samples = []
+        started = time.monotonic()
+        end = started + args.duration
+        sampler = threading.Thread(target=sample_ingest, args=(gateway.url, samples, end), daemon=True)
+        sampler.start()
+        fleet.start_inbound(args.inbound_rate)
+        senders, send_failures = run_senders(gateway.url, args, sent, end)
+        for thread in senders:
+            thread.join()
+        fleet.stop_inbound()
+        sampler.join()
+        traffic_seconds = time.monotonic() - started
+
+        # Wait for the reports still on their way, then for the gateway to store them
+        deadline = time.monotonic() + args.drain
+        while time.monotonic() < deadline:
+            replied = [mid for mid in sent if mid in fleet.replied]
+            if (all(mid in watcher.final_seen for mid in replied)
+                    and len(replied) + len(fleet.silent & set(sent)) >= len(sent)
+                    and len(watcher.inbound_seen) >= len(fleet.injected)):
+                break
+            time.sleep(0.2)
+        watcher.stop()
+        statistics = session.get(f"{gateway.url}/api/statistics").json()
+    finally:
+        fleet.stop()
+        gateway.stop()
+        broker.stop()
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    api_latency = [finished - begin for begin, finished in sent.values()]
+    to_device = [fleet.received[mid][0] - begin for mid, (begin, _) in sent.items() if mid in fleet.received]
+    to_final = [watcher.final_seen[mid] - begin for mid, (begin, _) in sent.items() if mid in watcher.final_seen]
+    report_ingest = [watcher.final_seen[mid] - fleet.replied[mid][0]
+                     for mid in sent if mid in watcher.final_seen and mid in fleet.replied]
+    inbound_latency = [watcher.inbound_seen[seq] - at for seq, at in fleet.injected.items()
+                       if seq in watcher.inbound_seen]
+
+    never_delivered = [mid for mid in sent if mid not in fleet.received]
+    silent = [mid for mid in sent if mid in fleet.silent]
+    stuck = {}
+    for mid in sent:
+        status = watcher.last_status.get(mid, 'unseen')
+        if status not in FINAL_STATUSES:
+            stuck[status] = stuck.get(status, 0) + 1
+    reports_lost = [mid for mid in sent if mid in fleet.replied and mid not in watcher.final_seen]
+    wrong_status = [mid for mid in sent if mid in fleet.replied and mid in watcher.final_seen
+                    and watcher.last_status.get(mid) != fleet.replied[mid][1]]
+
+    results = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'duration': args.duration,
+            'traffic_seconds': round(traffic_seconds, 2),
+            'drain': args.drain,
+            'warmup': warmup,
+            'send_rate': args.send_rate,
+            'inbound_rate': args.inbound_rate,
+            'concurrency': args.concurrency,
+            'sims': args.sims,
+            'delay': [args.delay_min, args.delay_max],
+            'failure_rate': args.failure_rate,
+            'duplicate_rate': args.duplicate_rate,
+            'silent_rate': args.silent_rate,
+            'report_sent': args.report_sent,
+            'overrides': args.overrides
+        },
+        'outgoing': {
+            'accepted': len(sent),
+            'rejected': send_failures,
+            'reached_device': len(sent) - len(never_delivered),
+            'never_reached_device': len(never_delivered),
+            'final_status': len([mid for mid in sent if mid in watcher.final_seen]),
+            'silent': len(silent),
+            'stuck': stuck,
+            'unexpectedly_stuck': sum(stuck.values()) - len(silent),
+            'reports_lost': len(reports_lost),
+            'wrong_final_status': len(wrong_status)
+        },
+        'incoming': {
+            'injected': len(fleet.injected),
+            'stored': len(watcher.inbound_seen),
+            'lost': len(fleet.injected) - len(watcher.inbound_seen)
+        },
+        'latency': {
+            'api': latency_summary(api_latency),
+            'send_to_device': latency_summary(to_device),
+            'send_to_final_status': latency_summary(to_final),
+            'report_to_stored': latency_summary(report_ingest),
+            'inbound_to_stored': latency_summary(inbound_latency)
+        },
+        'steady_state': {
+            'incoming_per_second': steady_rate(samples, 1, warmup),
+            'final_statuses_per_second': steady_rate(samples, 2, warmup),
+            'offered_incoming_per_second': args.inbound_rate,
+            'offered_final_statuses_per_second': round(args.send_rate * (1 - args.silent_rate), 2)
+        },
+        'devices': fleet.stats(),
+        'gateway': {key: statistics.get(key) for key in ('status_ingest', 'mqtt_workers', 'sim_scheduler')},
+        'change_feed_errors': watcher.errors
+    }
+
+    outgoing, incoming = results['outgoing'], results['incoming']
+    print(f"Outgoing: {outgoing['accepted']} accepted, {outgoing['never_reached_device']} never reached a device, "
+          f"{outgoing['final_status']} final, stuck {outgoing['stuck']} ({outgoing['silent']} silent), "
+          f"{outgoing['reports_lost']} reports lost")
+    print(f"Incoming: {incoming['injected']} injected, {incoming['stored']} stored, {incoming['lost']} lost")
+    print(f"{'latency':<22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, summary in results['latency'].items():
+        print(f"{name:<22} {summary['count']:>7} {summary['p50']!s:>9} {summary['p95']!s:>9} "
+              f"{summary['p99']!s:>9} {summary['max']!s:>9}")
+    steady = results['steady_state']
+    print(f"Steady state: {steady['incoming_per_second']} incoming/s (offered {steady['offered_incoming_per_second']}), "
+          f"{steady['final_statuses_per_second']} final statuses/s (offered {steady['offered_final_statuses_per_second']})")
+
+    output = args.output or os.path.join(REPO_ROOT, 'bench', 'results', f"soak-{(commit or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
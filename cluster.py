@@ -0,0 +1,90 @@
+import json
+import os
+import socket
+import uuid
+import paho.mqtt.client as mqtt
+from log_pipeline import get_logger
+
+logger = get_logger('cluster')
+
+
+def default_instance_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def shared_topic(topic, group):
+    """Subscription filter that makes the broker deliver each message to one member of ``group``"""
+    return f"$share/{group}/{topic}"
+
+
+class SocketRelay:
+    """Relays Socket.IO broadcasts between gateway instances over an MQTT topic.
+
+    Every instance publishes the frames it emits to ``topic`` and re-emits
+    frames published by the other instances to its own Socket.IO clients,
+    so a dashboard sees every update whichever instance it is connected to.
+    Events with a handler registered through ``on`` are passed to it
+    instead, e.g. cache invalidations.
+    """
+
+    def __init__(self, socketio, host, port, topic, instance_id, keepalive=60):
+        self.socketio = socketio
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.instance_id = instance_id
+        self.keepalive = keepalive
+        self.published = 0
+        self.relayed = 0
+        self._handlers = {}
+        self._client = mqtt.Client(client_id=f"relay-{instance_id}-{uuid.uuid4().hex[:8]}")
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+
+    def start(self):
+        try:
+            self._client.connect_async(self.host, self.port, self.keepalive)
+            self._client.loop_start()
+        except Exception as e:
+            logger.error("Failed to start Socket.IO relay: %s", e)
+
+    def stop(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        logger.info("Socket.IO relay connected to MQTT broker", extra={'rc': rc, 'topic': self.topic})
+        client.subscribe(self.topic)
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            envelope = json.loads(msg.payload.decode())
+            if envelope.get('origin') == self.instance_id:
+                return
+            handler = self._handlers.get(envelope['event'])
+            if handler is not None:
+                handler(envelope['data'])
+            else:
+                self.socketio.emit(envelope['event'], envelope['data'])
+            self.relayed += 1
+        except Exception as e:
+            logger.error("Error relaying Socket.IO event: %s", e)
+
+    def on(self, event, handler):
+        """Call ``handler(data)`` for ``event`` from the other instances instead of emitting it"""
+        self._handlers[event] = handler
+
+    def publish(self, event, data, qos=0):
+        """Send a frame emitted locally to the other instances"""
+        envelope = {'origin': self.instance_id, 'event': event, 'data': data}
+        self._client.publish(self.topic, json.dumps(envelope), qos=qos)
+        self.published += 1
+
+    def stats(self):
+        return {
+            'instance_id': self.instance_id,
+            'connected': self._client.is_connected(),
+            'published': self.published,
+            'relayed': self.relayed
+        }
@@ -1,10 +1,133 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
 from datetime import datetime
 import json
+import time
 import uuid
 from werkzeug.security import generate_password_hash
+from log_pipeline import get_logger
 
-db = SQLAlchemy()
+logger = get_logger('db')
+
+READER_BIND = 'reader'
+
+class RoutingSession(Session):
+    """Session that sends queries to the read-only engine while ``g.db_reader`` is set.
+
+    Flushes always go to the writer, so a read-only request that writes by
+    mistake still ends up on the right connection.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context()
+                and g.get('db_reader') and READER_BIND in self._db.engines):
+            return self._db.engines[READER_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+DEFAULT_STORAGE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout_ms': 5000,
+    'mmap_size': 268435456,
+    'cache_size_kb': 65536,
+    'auto_vacuum': 'INCREMENTAL',
+    'single_writer': True,
+    'reader_pool_size': 5
+}
+
+def configure_storage(app, profile=None):
+    """Set engine options for the SQLite storage profile. Call before ``db.init_app``.
+
+    With ``single_writer`` enabled the default engine keeps a single pooled
+    connection that serializes all writes, and a separate ``reader`` bind
+    with its own pool serves read-only requests.
+    """
+    profile = dict(DEFAULT_STORAGE_PROFILE, **(profile or {}))
+    app.config['SQLITE_PROFILE'] = profile
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+
+    if profile['single_writer']:
+        engine_options.update({'pool_size': 1, 'max_overflow': 0})
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds[READER_BIND] = dict(
+            engine_options,
+            url=app.config['SQLALCHEMY_DATABASE_URI'],
+            pool_size=profile['reader_pool_size'],
+            max_overflow=profile['reader_pool_size']
+        )
+
+def is_transient_error(error):
+    """True for errors that go away on retry: a locked database or an exhausted pool"""
+    if isinstance(error, exc.TimeoutError):
+        return True
+    if isinstance(error, exc.OperationalError):
+        text = str(error.orig).lower()
+        return 'locked' in text or 'busy' in text
+    return False
+
+def register_sqlite_pragmas(app):
+    """Apply the storage profile's pragmas on every new SQLite connection"""
+    profile = app.config.get('SQLITE_PROFILE', DEFAULT_STORAGE_PROFILE)
+
+    def make_listener(read_only):
+        def on_connect(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            if not read_only and profile.get('auto_vacuum'):
+                # Takes effect on new databases; existing ones need a VACUUM
+                cursor.execute(f"PRAGMA auto_vacuum = {profile['auto_vacuum']}")
+            if not read_only and profile.get('journal_mode'):
+                cursor.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+            if profile.get('synchronous'):
+                cursor.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+            cursor.execute(f"PRAGMA busy_timeout = {int(profile.get('busy_timeout_ms', 5000))}")
+            if profile.get('mmap_size'):
+                cursor.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+            if profile.get('cache_size_kb'):
+                # Negative values are interpreted by SQLite as KiB
+                cursor.execute(f"PRAGMA cache_size = -{int(profile['cache_size_kb'])}")
+            if read_only:
+                cursor.execute("PRAGMA query_only = ON")
+            cursor.close()
+        return on_connect
+
+    for bind_key, engine in db.engines.items():
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', make_listener(bind_key == READER_BIND))
+
+def register_session_metrics(histogram):
+    """Observe the duration of every session flush and commit on ``histogram``.
+
+    ``histogram`` takes one label, the operation (``flush`` or ``commit``).
+    A commit includes the flush it triggers.
+    """
+    flush_seconds = histogram.labels('flush')
+    commit_seconds = histogram.labels('commit')
+
+    def start(key):
+        def listener(session, *args):
+            session.info[key] = time.perf_counter()
+        return listener
+
+    def finish(key, target):
+        def listener(session, *args):
+            started = session.info.pop(key, None)
+            if started is not None:
+                target.observe(time.perf_counter() - started)
+        return listener
+
+    def discard(session, *args):
+        session.info.pop('metrics_commit_started', None)
+        session.info.pop('metrics_flush_started', None)
+
+    event.listen(RoutingSession, 'before_flush', start('metrics_flush_started'))
+    event.listen(RoutingSession, 'after_flush_postexec', finish('metrics_flush_started', flush_seconds))
+    event.listen(RoutingSession, 'before_commit', start('metrics_commit_started'))
+    event.listen(RoutingSession, 'after_commit', finish('metrics_commit_started', commit_seconds))
+    event.listen(RoutingSession, 'after_rollback', discard)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,13 +137,28 @@ class User(db.Model):
     api_key = db.Column(db.String(64), unique=True)
 
 class SimCard(db.Model):
+    __table_args__ = (
+        db.Index('ix_sim_card_number', 'number'),
+        db.Index('ix_sim_card_status', 'status'),
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     number = db.Column(db.String(20), nullable=False)
     status = db.Column(db.String(20), nullable=False, default='active')
     last_used = db.Column(db.DateTime, default=datetime.utcnow)
+    # Share of unpinned traffic under the 'weighted' scheduling strategy
+    weight = db.Column(db.Integer, nullable=False, default=1)
     messages = db.relationship('Message', backref='sim_card', lazy=True)
 
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_direction_timestamp', 'direction', 'timestamp', 'id'),
+        db.Index('ix_message_timestamp', 'timestamp', 'id'),
+        db.Index('ix_message_status', 'status'),
+        db.Index('ix_message_sender_sim', 'sender_sim', 'timestamp'),
+        db.Index('ix_message_change_seq', 'change_seq'),
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     sender = db.Column(db.String(20))
     recipient = db.Column(db.String(20), nullable=False)
@@ -29,6 +167,8 @@ class Message(db.Model):
     status = db.Column(db.String(20), default='pending')
     direction = db.Column(db.String(10), nullable=False)  # 'incoming' or 'outgoing'
     sender_sim = db.Column(db.String(36), db.ForeignKey('sim_card.id'))
+    # Assigned by database triggers, see migration_add_change_feed
+    change_seq = db.Column(db.Integer)
 
     def to_dict(self):
         return {
@@ -38,13 +178,34 @@ class Message(db.Model):
             'message_id': self.id 
         }
 
+    def to_api_dict(self):
+        """Full representation used by the list endpoints and dashboard updates"""
+        return {
+            'id': self.id,
+            'message_id': self.id,
+            'number': self.recipient,
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'message': self.message,
+            'status': self.status,
+            'direction': self.direction,
+            'sender_sim': self.sender_sim,
+            'timestamp': int(self.timestamp.timestamp()) if self.timestamp else None
+        }
+
 class Log(db.Model):
+    __table_args__ = (
+        db.Index('ix_log_timestamp', 'timestamp', 'id'),
+        db.Index('ix_log_change_seq', 'change_seq'),
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     action = db.Column(db.String(50), nullable=False)
     details = db.Column(db.Text)
     status = db.Column(db.String(20))
     sender_sim = db.Column(db.String(36), db.ForeignKey('sim_card.id'))
+    change_seq = db.Column(db.Integer)
 
     def to_dict(self):
         try:
@@ -62,6 +223,12 @@ class Log(db.Model):
 
 class SmsStatus(db.Model):
     __tablename__ = 'sms_status'
+    __table_args__ = (
+        db.Index('ix_sms_status_timestamp', 'timestamp', 'id'),
+        db.Index('ix_sms_status_change_seq', 'change_seq'),
+        # Redelivered status reports are dropped on insert
+        db.Index('uq_sms_status_message_status', 'message_id', 'status', unique=True),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     sender_number = db.Column(db.String(20), nullable=False)
@@ -69,10 +236,13 @@ class SmsStatus(db.Model):
     message = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(20), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    message_id = db.Column(db.String(36))
+    change_seq = db.Column(db.Integer)
 
     def to_dict(self):
         return {
             "id": self.id,
+            "message_id": self.message_id,
             "sender_number": self.sender_number,
             "receiver_number": self.receiver_number,
             "message": self.message,
@@ -80,9 +250,174 @@ class SmsStatus(db.Model):
             "timestamp": int(self.timestamp.timestamp())
         }
 
+class MessageStat(db.Model):
+    """Hourly message counts per direction, SIM and status.
+
+    Maintained in the same transactions that insert messages or change
+    their status (see rollups.py), so statistics never scan ``message``.
+    """
+    __tablename__ = 'message_stat'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('bucket', 'direction', 'sim_id', 'status'),
+    )
+
+    bucket = db.Column(db.DateTime, nullable=False)
+    direction = db.Column(db.String(10), nullable=False)
+    sim_id = db.Column(db.String(36), nullable=False, default='')
+    status = db.Column(db.String(20), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class MessageArchive(db.Model):
+    """One per-month archive database holding messages moved out of ``message``.
+
+    Kept up to date by the archiver in tiering.py and used by list queries
+    to decide which archive files a time range needs.
+    """
+    __tablename__ = 'message_archive'
+
+    month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM'
+    path = db.Column(db.String(255), nullable=False)
+    min_timestamp = db.Column(db.DateTime, nullable=False)
+    max_timestamp = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def migration_add_indexes(connection):
+    """Secondary indexes for the list, statistics and lookup queries"""
+    statements = [
+        'CREATE INDEX IF NOT EXISTS ix_sim_card_number ON sim_card (number)',
+        'CREATE INDEX IF NOT EXISTS ix_sim_card_status ON sim_card (status)',
+        'CREATE INDEX IF NOT EXISTS ix_message_direction_timestamp ON message (direction, timestamp, id)',
+        'CREATE INDEX IF NOT EXISTS ix_message_timestamp ON message (timestamp, id)',
+        'CREATE INDEX IF NOT EXISTS ix_message_status ON message (status)',
+        'CREATE INDEX IF NOT EXISTS ix_message_sender_sim ON message (sender_sim, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_log_timestamp ON log (timestamp, id)',
+        'CREATE INDEX IF NOT EXISTS ix_sms_status_timestamp ON sms_status (timestamp, id)',
+    ]
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+def backfill_message_stats(connection):
+    """Rebuild the message_stat rollup from the message table.
+
+    Buckets use the same text format SQLAlchemy stores DateTime values in.
+    """
+    connection.exec_driver_sql('DELETE FROM message_stat')
+    connection.exec_driver_sql("""
+        INSERT INTO message_stat (bucket, direction, sim_id, status, count)
+        SELECT strftime('%Y-%m-%d %H:00:00.000000', timestamp), direction,
+               COALESCE(sender_sim, ''), COALESCE(status, ''), COUNT(*)
+        FROM message
+        WHERE timestamp IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    """)
+
+
+CHANGE_FEED_TABLES = ('message', 'log', 'sms_status')
+
+def add_column_if_missing(connection, table, column, ddl):
+    columns = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+def migration_add_change_feed(connection):
+    """Stamp every insert/update of message, log and sms_status with a change sequence.
+
+    A single-row ``change_counter`` table holds the last sequence handed out.
+    Triggers bump it and copy it into the row, so bulk inserts and raw SQL
+    are covered as well as ORM writes. SQLite serializes writers, so
+    sequences become visible in commit order.
+    """
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS change_counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)'
+    )
+    connection.exec_driver_sql('INSERT OR IGNORE INTO change_counter (id, value) VALUES (1, 0)')
+
+    for table in CHANGE_FEED_TABLES:
+        add_column_if_missing(connection, table, 'change_seq', 'INTEGER')
+        connection.exec_driver_sql(
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_change_seq ON {table} (change_seq)'
+        )
+        # Number existing rows after everything handed out so far
+        connection.exec_driver_sql(f"""
+            UPDATE {table} SET change_seq = (SELECT value FROM change_counter WHERE id = 1) + rowid
+            WHERE change_seq IS NULL
+        """)
+        connection.exec_driver_sql(f"""
+            UPDATE change_counter SET value = MAX(value, (SELECT COALESCE(MAX(change_seq), 0) FROM {table}))
+            WHERE id = 1
+        """)
+
+        stamp = f"""
+            BEGIN
+                UPDATE change_counter SET value = value + 1 WHERE id = 1;
+                UPDATE {table} SET change_seq = (SELECT value FROM change_counter WHERE id = 1)
+                WHERE rowid = NEW.rowid;
+            END
+        """
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_insert_seq AFTER INSERT ON {table} {stamp}'
+        )
+
+    # Only messages are updated after insert; listing the columns keeps the
+    # trigger from firing on its own change_seq update
+    connection.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS trg_message_update_seq
+        AFTER UPDATE OF status, sender, recipient, message, sender_sim ON message
+        BEGIN
+            UPDATE change_counter SET value = value + 1 WHERE id = 1;
+            UPDATE message SET change_seq = (SELECT value FROM change_counter WHERE id = 1)
+            WHERE rowid = NEW.rowid;
+        END
+    """)
+
+
+def migration_add_sim_weight(connection):
+    add_column_if_missing(connection, 'sim_card', 'weight', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def migration_add_status_dedupe(connection):
+    add_column_if_missing(connection, 'sms_status', 'message_id', 'VARCHAR(36)')
+    connection.exec_driver_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_sms_status_message_status ON sms_status (message_id, status)'
+    )
+
+
+# Ordered list of (version, migration). Append new migrations at the end;
+# never renumber or edit one that has shipped.
+MIGRATIONS = [
+    (1, migration_add_indexes),
+    (2, backfill_message_stats),
+    (3, migration_add_change_feed),
+    (4, migration_add_sim_weight),
+    (5, migration_add_status_dedupe),
+]
+
+def get_schema_version(connection):
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+def run_migrations():
+    """Upgrade an existing database in place to the latest schema version.
+
+    The applied version is stored in SQLite's ``user_version`` pragma, so
+    each migration runs exactly once per database file.
+    """
+    with db.engine.begin() as connection:
+        current = get_schema_version(connection)
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info("Applying database migration", extra={'version': version, 'migration': migration.__name__})
+            migration(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+            current = version
+
 def init_db(app):
     with app.app_context():
+        register_sqlite_pragmas(app)
         db.create_all()
+        run_migrations()
         
         # Check if admin user exists
         admin = User.query.filter_by(username='admin').first()
@@ -0,0 +1,117 @@
+import threading
+import eventlet
+from log_pipeline import get_logger
+
+logger = get_logger('events')
+
+
+class EventBatcher:
+    """Coalesces dashboard updates into one Socket.IO frame per window.
+
+    Producers record changed rows instead of emitting events directly. Every
+    ``window_ms`` the batcher emits a single ``gateway_update`` frame:
+
+        {
+            "messages": [...],   # new or updated messages, one entry per id
+            "logs": [...],       # new log entries
+            "statuses": [...],   # new delivery status records
+            "counters": {...},   # count deltas, e.g. {"inbox": 1, "logs": 2}
+            "truncated": false   # true when rows were dropped; refetch instead
+        }
+
+    Message updates for the same id within a window are merged, so a message
+    created and then acknowledged is sent once with its latest state. With a
+    ``relay`` every frame is also passed to the other gateway instances.
+    """
+
+    def __init__(self, socketio, window_ms=250, max_rows=500, event='gateway_update', relay=None):
+        self.socketio = socketio
+        self.relay = relay
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self.event = event
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._running = False
+        self.frames_sent = 0
+        self.events_batched = 0
+        self._reset()
+
+    def _reset(self):
+        self._messages = {}
+        self._logs = []
+        self._statuses = []
+        self._counters = {}
+        self._truncated = False
+
+    def message(self, row):
+        """Record a new message or a partial update keyed by ``row['id']``"""
+        with self._lock:
+            existing = self._messages.get(row['id'])
+            if existing is not None:
+                existing.update(row)
+            elif len(self._messages) < self.max_rows:
+                self._messages[row['id']] = dict(row)
+            else:
+                self._truncated = True
+            self.events_batched += 1
+        self._pending.set()
+
+    def log(self, row):
+        self._append(self._logs, row)
+
+    def status(self, row):
+        self._append(self._statuses, row)
+
+    def count(self, name, delta=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + delta
+            self.events_batched += 1
+        self._pending.set()
+
+    def _append(self, rows, row):
+        with self._lock:
+            if len(rows) < self.max_rows:
+                rows.append(row)
+            else:
+                self._truncated = True
+            self.events_batched += 1
+        self._pending.set()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+        self._pending.set()
+
+    def run(self):
+        while self._running:
+            self._pending.wait()
+            # Let the window fill up before sending
+            eventlet.sleep(self.window)
+            self._pending.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Error emitting update frame: %s", e)
+
+    def flush(self):
+        with self._lock:
+            frame = {
+                'messages': list(self._messages.values()),
+                'logs': self._logs,
+                'statuses': self._statuses,
+                'counters': self._counters,
+                'truncated': self._truncated
+            }
+            self._reset()
+        if not (frame['messages'] or frame['logs'] or frame['statuses'] or frame['counters']):
+            return
+        self.socketio.emit(self.event, frame)
+        if self.relay is not None:
+            self.relay.publish(self.event, frame)
+        self.frames_sent += 1
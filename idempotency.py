@@ -0,0 +1,56 @@
+import hashlib
+from auth_cache import TTLCache
+
+_IN_PROGRESS = 'in_progress'
+
+
+class IdempotencyStore:
+    """Remembers responses to requests sent with an ``Idempotency-Key`` header.
+
+    A retried request with the same key and body gets the stored response
+    instead of being executed again. Keys are scoped per user, expire after
+    ``ttl`` seconds and at most ``max_size`` are kept. A key whose request is
+    still running is held for ``in_progress_ttl`` seconds so a crashed
+    request does not block retries forever.
+    """
+
+    def __init__(self, max_size=10000, ttl=86400, in_progress_ttl=60):
+        self.ttl = ttl
+        self.in_progress_ttl = in_progress_ttl
+        self._entries = TTLCache(max_size)
+        self.replayed = 0
+
+    @staticmethod
+    def fingerprint(body):
+        return hashlib.sha256(body or b'').hexdigest()
+
+    def begin(self, key, fingerprint):
+        """Claim ``key`` for a new request.
+
+        Returns ``(state, response)`` where state is ``'new'`` (go ahead),
+        ``'replay'`` (``response`` is the stored ``(body, status)``),
+        ``'in_progress'`` or ``'mismatch'`` (same key, different body).
+        """
+        if self._entries.add(key, (_IN_PROGRESS, fingerprint, None), self.in_progress_ttl):
+            return 'new', None
+        entry = self._entries.get(key, None)
+        if entry is None:
+            # Expired between the two calls
+            return self.begin(key, fingerprint)
+        state, stored_fingerprint, response = entry
+        if stored_fingerprint != fingerprint:
+            return 'mismatch', None
+        if state == _IN_PROGRESS:
+            return 'in_progress', None
+        self.replayed += 1
+        return 'replay', response
+
+    def complete(self, key, fingerprint, body, status):
+        self._entries.set(key, ('done', fingerprint, (body, status)), self.ttl)
+
+    def abandon(self, key):
+        """Forget a key whose request failed, so a retry runs again"""
+        self._entries.delete(key)
+
+    def stats(self):
+        return {'keys': len(self._entries), 'replayed': self.replayed}
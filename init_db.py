@@ -1,4 +1,6 @@
+import sys
 from app import app, db, User
+from database import backfill_message_stats
 from werkzeug.security import generate_password_hash
 
 def init_db():
@@ -22,5 +24,25 @@ def init_db():
         else:
             print("Admin user already exists!")
 
+def backfill_stats():
+    """Rebuild the statistics rollup from the message table"""
+    with app.app_context():
+        with db.engine.begin() as connection:
+            backfill_message_stats(connection)
+        print("Message statistics rebuilt successfully!")
+
+def vacuum():
+    """Rewrite the database file, switching it to incremental auto-vacuum"""
+    with app.app_context():
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('VACUUM')
+            mode = connection.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+        print(f"Database vacuumed, auto_vacuum mode is now {mode}")
+
 if __name__ == '__main__':
-    init_db() 
\ No newline at end of file
+    if '--backfill-stats' in sys.argv:
+        backfill_stats()
+    elif '--vacuum' in sys.argv:
+        vacuum()
+    else:
+        init_db()
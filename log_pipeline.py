@@ -0,0 +1,175 @@
+import atexit
+import datetime
+import json
+import logging
+import random
+import sys
+from eventlet import patcher
+
+# The writer must not run on the eventlet hub: a slow stdout would stall every green thread
+_real_threading = patcher.original('threading')
+_real_queue = patcher.original('queue')
+
+ROOT_LOGGER = 'gateway'
+
+# Attributes every LogRecord has; anything else was passed with ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_STOP = object()
+
+_payload_sample_rate = 0.0
+_payload_max_chars = 1000
+
+
+def get_logger(component):
+    """Logger for one gateway component, e.g. ``get_logger('mqtt')`` -> ``gateway.mqtt``"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{component}")
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS and not key.startswith('_')}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the fields passed in ``extra`` (message_id, sim, ...)"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'component': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(_fields(record))
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable lines for development: time, level, component, message, key=value fields"""
+
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a bounded queue for the writer thread and never blocks.
+
+    The message is rendered here so the record does not hold on to objects
+    that change later. When the queue is full the record is dropped and
+    counted in ``dropped``.
+    """
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        self.queued = 0
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except _real_queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def stats(self):
+        return {'queued': self.queued, 'dropped': self.dropped, 'pending': self.queue.qsize()}
+
+
+class LogWriter:
+    """Drains the log queue into the output handlers on a real OS thread"""
+
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        for handler in handlers:
+            # Handlers created after monkey patching get a green lock, which an OS thread cannot use
+            handler.lock = _real_threading.RLock()
+        self._thread = _real_threading.Thread(target=self._run, name='log-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        """Write what is still queued, then stop"""
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except _real_queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def configure_logging(settings=None):
+    """Route the ``gateway`` loggers through a queue to stdout.
+
+    ``settings`` is the ``Logging`` section of config.json: ``level``,
+    per-component ``levels``, ``format`` (``json`` or ``text``),
+    ``queue_size``, ``payload_sample_rate`` and ``payload_max_chars``.
+    Returns the queue handler, whose ``stats()`` report dropped records.
+    """
+    global _payload_sample_rate, _payload_max_chars
+    settings = settings or {}
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(str(settings.get('level', 'INFO')).upper())
+    for component, level in (settings.get('levels') or {}).items():
+        get_logger(component).setLevel(str(level).upper())
+    root.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if settings.get('format') == 'text' else JsonFormatter())
+    queue = _real_queue.Queue(maxsize=settings.get('queue_size', 10000))
+    handler = QueueHandler(queue)
+    writer = LogWriter(queue, [output])
+    writer.start()
+    atexit.register(writer.stop)
+
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    _payload_sample_rate = settings.get('payload_sample_rate', 0.0) or 0.0
+    _payload_max_chars = settings.get('payload_max_chars', 1000)
+    return handler
+
+
+def log_payload(logger, msg, payload, **fields):
+    """Log ``payload`` at DEBUG for a sampled share of calls.
+
+    Costs one level check when DEBUG is off for ``logger``. Sampling is
+    set by ``Logging.payload_sample_rate`` and long payloads are cut to
+    ``Logging.payload_max_chars``.
+    """
+    if not _payload_sample_rate or not logger.isEnabledFor(logging.DEBUG):
+        return
+    if _payload_sample_rate < 1 and random.random() >= _payload_sample_rate:
+        return
+    if isinstance(payload, bytes):
+        payload = payload.decode(errors='replace')
+    elif not isinstance(payload, str):
+        payload = json.dumps(payload, default=str, ensure_ascii=False)
+    if _payload_max_chars and len(payload) > _payload_max_chars:
+        payload = payload[:_payload_max_chars] + '...'
+    logger.debug(msg, extra=dict(fields, payload=payload))
@@ -0,0 +1,163 @@
+import itertools
+import threading
+import time
+import uuid
+import paho.mqtt.client as mqtt
+from log_pipeline import get_logger
+
+logger = get_logger('publisher')
+
+
+class MqttPublisher:
+    """Pool of long-lived MQTT clients used for outgoing publishes.
+
+    Each client keeps its own connection to the broker and is reconnected
+    automatically by paho's network loop, so a publish only costs the
+    PUBLISH/PUBACK round-trip instead of a full connect/disconnect cycle.
+    Acknowledged publishes are timed on ``publish_seconds`` when given,
+    from the write to the broker's acknowledgement of that message.
+    """
+
+    def __init__(self, host, port, pool_size=1, keepalive=60,
+                 publish_timeout=10, max_inflight=100, client_id_prefix='edge-publisher',
+                 publish_seconds=None):
+        self.host = host
+        self.publish_seconds = publish_seconds
+        self.port = port
+        self.keepalive = keepalive
+        self.publish_timeout = publish_timeout
+        self.max_inflight = max_inflight
+        self._lock = threading.RLock()
+        self._inflight = {}
+        self._published = 0
+        self._failed = 0
+        self._clients = []
+        self._client_ids = {}
+        for index in range(max(1, pool_size)):
+            client_id = f"{client_id_prefix}-{index}-{uuid.uuid4().hex[:8]}"
+            client = self._create_client(client_id)
+            self._clients.append(client)
+            self._client_ids[id(client)] = client_id
+        self._next_client = itertools.cycle(self._clients)
+
+    def _create_client(self, client_id):
+        client = mqtt.Client(client_id=client_id)
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.max_inflight_messages_set(self.max_inflight)
+
+        def on_connect(client, userdata, flags, rc):
+            logger.info("Publisher connected to MQTT broker", extra={'client_id': client_id, 'rc': rc})
+
+        def on_disconnect(client, userdata, rc):
+            logger.warning("Publisher disconnected from MQTT broker", extra={'client_id': client_id, 'rc': rc})
+
+        def on_publish(client, userdata, mid):
+            with self._lock:
+                entry = self._inflight.pop((client_id, mid), None)
+            if entry is not None and self.publish_seconds is not None:
+                self.publish_seconds.observe(time.perf_counter() - entry[1])
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.on_publish = on_publish
+        return client
+
+    def start(self):
+        """Connect every pooled client and start its network loop."""
+        for client in self._clients:
+            try:
+                client.connect_async(self.host, self.port, self.keepalive)
+                client.loop_start()
+            except Exception as e:
+                logger.error("Failed to start MQTT publisher: %s", e)
+
+    def stop(self):
+        for client in self._clients:
+            client.loop_stop()
+            client.disconnect()
+
+    def _next_connected_client(self):
+        # Skip clients that are reconnecting; paho would otherwise queue the
+        # message and send it later, after the caller has given up on it.
+        for _ in range(len(self._clients)):
+            client = next(self._next_client)
+            if client.is_connected():
+                return client
+        return None
+
+    def publish(self, topic, payload, qos=1, wait=True):
+        """Publish a payload through the next pooled client.
+
+        With ``wait`` set, blocks until the broker acknowledges the message
+        (PUBACK for QoS 1) and raises ``RuntimeError`` if it is not
+        delivered within ``publish_timeout`` seconds.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            client = self._next_connected_client()
+            if client is None:
+                self._failed += 1
+                raise RuntimeError(f"No MQTT publisher connected to {self.host}:{self.port}")
+            info = client.publish(topic, payload, qos=qos)
+            if qos > 0 and info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self._inflight[(self._client_ids[id(client)], info.mid)] = (topic, started)
+
+        if not wait:
+            return info
+
+        try:
+            info.wait_for_publish(timeout=self.publish_timeout)
+            if not info.is_published():
+                raise RuntimeError(f"Timed out waiting for broker to acknowledge message on {topic}")
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+
+        with self._lock:
+            self._published += 1
+        return info
+
+    def publish_many(self, messages, qos=1):
+        """Pipeline a batch of ``(topic, payload)`` publishes.
+
+        All messages are written before waiting for any acknowledgement.
+        Returns one entry per message: ``None`` on success or the exception
+        raised for that message.
+        """
+        pending = []
+        for topic, payload in messages:
+            try:
+                pending.append(self.publish(topic, payload, qos=qos, wait=False))
+            except Exception as e:
+                pending.append(e)
+
+        results = []
+        deadline = time.monotonic() + self.publish_timeout
+        for info in pending:
+            if isinstance(info, Exception):
+                results.append(info)
+                continue
+            try:
+                info.wait_for_publish(timeout=max(0, deadline - time.monotonic()))
+                if not info.is_published():
+                    raise RuntimeError("Timed out waiting for broker to acknowledge message")
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                results.append(e)
+                continue
+            with self._lock:
+                self._published += 1
+            results.append(None)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_size': len(self._clients),
+                'connected': sum(1 for c in self._clients if c.is_connected()),
+                'inflight': len(self._inflight),
+                'published': self._published,
+                'failed': self._failed
+            }
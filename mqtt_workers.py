@@ -0,0 +1,99 @@
+import itertools
+import json
+import threading
+from eventlet.queue import LightQueue, Full
+from log_pipeline import get_logger
+
+logger = get_logger('workers')
+
+
+def json_key(field):
+    """Ordering key taken from a field of a JSON payload; ``None`` if it is missing"""
+    def key(payload):
+        try:
+            value = json.loads(payload).get(field)
+        except (ValueError, AttributeError):
+            return None
+        return str(value) if value is not None else None
+    return key
+
+
+class MessageWorkerPool:
+    """Runs MQTT message handlers on worker green threads instead of paho's network loop.
+
+    ``submit`` only puts the raw payload on a bounded queue, so the network
+    loop keeps reading packets and answering keepalives while handlers wait
+    on the database. Payloads with the same ``key`` always go to the same
+    worker and are handled in arrival order; payloads without a key are
+    spread round-robin. When a worker's queue is full the payload is
+    dropped and counted.
+    """
+
+    def __init__(self, socketio, handler, name, workers=4, max_queue=10000, key=None):
+        self.socketio = socketio
+        self.handler = handler
+        self.name = name
+        self.key = key
+        workers = max(1, workers)
+        self._queues = [LightQueue(maxsize=max(1, max_queue // workers)) for _ in range(workers)]
+        self._next_queue = itertools.cycle(range(workers))
+        self._lock = threading.Lock()
+        self._running = False
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for queue in self._queues:
+            self.socketio.start_background_task(self.run, queue)
+
+    def stop(self):
+        self._running = False
+
+    def submit(self, payload):
+        key = self.key(payload) if self.key else None
+        if key is None:
+            index = next(self._next_queue)
+        else:
+            index = hash(key) % len(self._queues)
+        try:
+            self._queues[index].put_nowait(payload)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning("Dropped %s message, worker queue is full", self.name)
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def run(self, queue):
+        while self._running:
+            payload = queue.get()
+            try:
+                self.handler(payload)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.exception("Error handling %s message: %s", self.name, e)
+            with self._lock:
+                self.processed += 1
+
+    def depth(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self._queues),
+                'depth': self.depth(),
+                'max_depth': sum(queue.maxsize for queue in self._queues),
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dropped': self.dropped
+            }
@@ -13,12 +13,13 @@ class SmsGatewayClient:
             'Content-Type': 'application/json'
         }
 
-    def send_sms(self, recipient, message, sim_card_id=None):
+    def send_sms(self, recipient, message, sim_card_id=None, idempotency_key=None):
         """
         Send an SMS message.
         :param recipient: Phone number (must start with + and country code)
         :param message: Message text
         :param sim_card_id: (Optional) SIM card ID to use
+        :param idempotency_key: (Optional) Unique key; retrying with the same key never sends twice
         :return: Response JSON
         """
         payload = {
@@ -27,11 +28,45 @@ class SmsGatewayClient:
         }
         if sim_card_id:
             payload['sim_card_id'] = sim_card_id
+        headers = self.headers
+        if idempotency_key:
+            headers = dict(self.headers, **{'Idempotency-Key': idempotency_key})
 
         response = requests.post(
             f"{self.api_url}/api/sms",
             json=payload,
-            headers=self.headers
+            headers=headers
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def send_bulk(self, messages=None, template=None, recipients=None, sim_card_id=None, idempotency_key=None):
+        """
+        Send many SMS messages in one request.
+        :param messages: List of dicts with recipient, message and optional sim_card_id
+        :param template: Message text used for every entry in recipients
+        :param recipients: Phone numbers, or dicts with recipient and template params
+        :param sim_card_id: (Optional) SIM card ID to use with a template
+        :param idempotency_key: (Optional) Unique key; retrying with the same key never sends twice
+        :return: Response JSON with per-recipient message IDs and errors
+        """
+        if messages is not None:
+            payload = {'messages': messages}
+        else:
+            payload = {
+                'message': template,
+                'recipients': recipients or []
+            }
+            if sim_card_id:
+                payload['sim_card_id'] = sim_card_id
+        headers = self.headers
+        if idempotency_key:
+            headers = dict(self.headers, **{'Idempotency-Key': idempotency_key})
+
+        response = requests.post(
+            f"{self.api_url}/api/sms/bulk",
+            json=payload,
+            headers=headers
         )
         response.raise_for_status()
         return response.json()
@@ -0,0 +1,114 @@
+import base64
+import datetime
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.split('|', 1)
+        return datetime.datetime.fromisoformat(timestamp), row_id
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def parse_time(value):
+    """Accept either epoch seconds or an ISO 8601 string (UTC)"""
+    try:
+        return datetime.datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid time value: {value}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def page_limit(args):
+    """Page size for a list request, or ``None`` to return every matching row.
+
+    Requests without ``limit`` or a cursor get every row, as the list
+    endpoints did before they were paginated; a cursor alone pages by
+    ``DEFAULT_LIMIT``.
+    """
+    if args.get('limit') is None and not args.get('before') and not args.get('after'):
+        return None
+    return parse_limit(args.get('limit'))
+
+
+def paginate(query, timestamp_column, id_column, args, filters=None):
+    """Apply keyset pagination to ``query`` ordered by (timestamp, id).
+
+    Supported query args: ``limit`` (see ``page_limit``), ``sort``
+    (asc/desc, default desc), ``before``/``after`` cursors,
+    ``since``/``until`` time range and ``count`` to include the total
+    number of matching rows. ``filters`` maps query arg names to columns
+    compared for equality.
+
+    Returns ``(rows, next_cursor, total)``. ``next_cursor`` is passed back as
+    ``before`` when sorting descending and as ``after`` when ascending.
+    """
+    limit = page_limit(args)
+    descending = args.get('sort', 'desc').lower() != 'asc'
+
+    for name, column in (filters or {}).items():
+        value = args.get(name)
+        if value:
+            query = query.filter(column == value)
+    if args.get('since'):
+        query = query.filter(timestamp_column >= parse_time(args['since']))
+    if args.get('until'):
+        query = query.filter(timestamp_column < parse_time(args['until']))
+
+    total = None
+    if args.get('count', '').lower() in ('1', 'true', 'yes'):
+        total = query.order_by(None).count()
+
+    key = tuple_(timestamp_column, id_column)
+    if args.get('before'):
+        query = query.filter(key < tuple_(*decode_cursor(args['before'])))
+    if args.get('after'):
+        query = query.filter(key > tuple_(*decode_cursor(args['after'])))
+
+    if descending:
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(timestamp_column.asc(), id_column.asc())
+
+    if limit is None:
+        return query.all(), None, total
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            getattr(last, timestamp_column.key),
+            getattr(last, id_column.key)
+        )
+    return rows, next_cursor, total
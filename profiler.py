@@ -0,0 +1,255 @@
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+from eventlet import patcher
+
+# The sampler must keep running while the hub is busy, so it uses a real OS thread
+_real_threading = patcher.original('threading')
+_real_time = patcher.original('time')
+
+
+class RequestProfiler:
+    """Runs cProfile on a sample of live HTTP requests and aggregates the results.
+
+    ``start`` arms the profiler for a share of requests (``sample_rate``),
+    optionally only those matching ``route`` and at most ``count`` of them,
+    for up to ``duration`` seconds. Stats are merged per route and can be
+    read back as text or as a pstats file.
+
+    cProfile hooks the whole OS thread, so only one request is profiled at
+    a time, and green threads that run while that request waits on I/O are
+    included in its profile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._active = None
+        self._config = None
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    def start(self, sample_rate=1.0, count=None, route=None, duration=60):
+        with self._lock:
+            self._config = {
+                'sample_rate': sample_rate,
+                'remaining': count,
+                'route': route,
+                'expires_at': time.monotonic() + duration
+            }
+            self._stats = {}
+            self.profiled = 0
+            self.skipped_busy = 0
+
+    def stop(self):
+        with self._lock:
+            self._config = None
+
+    @property
+    def enabled(self):
+        config = self._config
+        if config is None:
+            return False
+        if time.monotonic() >= config['expires_at'] or config['remaining'] == 0:
+            self._config = None
+            return False
+        return True
+
+    def begin(self, route):
+        """Start profiling the current request if it is sampled; returns a token for ``end``"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            config = self._config
+            if config is None or (config['route'] and config['route'] != route):
+                return None
+            if random.random() >= config['sample_rate']:
+                return None
+            if self._active is not None:
+                self.skipped_busy += 1
+                return None
+            if config['remaining'] is not None:
+                config['remaining'] -= 1
+            profile = cProfile.Profile()
+            self._active = profile
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler already owns the thread
+            with self._lock:
+                self._active = None
+            return None
+        return route, profile
+
+    def end(self, token):
+        if token is None:
+            return
+        route, profile = token
+        profile.disable()
+        with self._lock:
+            self._active = None
+            self.profiled += 1
+            if route in self._stats:
+                self._stats[route].add(profile)
+            else:
+                self._stats[route] = pstats.Stats(profile)
+
+    def _merged(self, route=None):
+        with self._lock:
+            stats = [s for r, s in self._stats.items() if route is None or r == route]
+            if not stats:
+                return None
+            merged = pstats.Stats()
+            merged.add(*stats)
+        return merged
+
+    def report(self, route=None, sort='cumulative', limit=50):
+        """pstats listing of the ``limit`` most expensive functions"""
+        merged = self._merged(route)
+        if merged is None:
+            return ''
+        out = io.StringIO()
+        merged.stream = out
+        merged.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, route=None):
+        """Stats in the pstats file format, loadable with ``pstats.Stats(path)``"""
+        merged = self._merged(route)
+        return marshal.dumps(merged.stats) if merged is not None else None
+
+    def stats(self):
+        with self._lock:
+            config = dict(self._config) if self._config else None
+            routes = {route: s.total_calls for route, s in self._stats.items()}
+        if config:
+            config['seconds_left'] = round(max(0, config.pop('expires_at') - time.monotonic()), 1)
+        return {
+            'enabled': self.enabled,
+            'config': config,
+            'profiled': self.profiled,
+            'skipped_busy': self.skipped_busy,
+            'routes': routes
+        }
+
+
+class StackSampler:
+    """Samples the Python stacks of every OS thread at a fixed interval.
+
+    Under eventlet the hub and all green threads, including the paho
+    network loops, run on the main thread, so its samples show whichever
+    green thread held the CPU. Idle time shows up as the hub's poll call.
+    Stacks are counted in the collapsed format used by flamegraph tools.
+    """
+
+    def __init__(self):
+        self._lock = _real_threading.Lock()
+        self._counts = {}
+        self._stop_event = None
+        self._running = False
+        self.interval = None
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, interval=0.01, duration=30):
+        self.stop()
+        stop_event = _real_threading.Event()
+        with self._lock:
+            self._counts = {}
+            self.samples = 0
+            self._stop_event = stop_event
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._running = True
+        _real_threading.Thread(
+            target=self._run, args=(interval, duration, stop_event), name='stack-sampler', daemon=True
+        ).start()
+
+    def stop(self):
+        """Signal the sampling thread and return at once.
+
+        Joining an OS thread from the eventlet hub would block every green
+        thread; the sampler instead checks its stop event before recording
+        a sample, so nothing is counted after ``stop`` returns.
+        """
+        with self._lock:
+            stop_event, self._stop_event = self._stop_event, None
+            if stop_event is None:
+                return
+            stop_event.set()
+            self._running = False
+            self.stopped_at = time.time()
+
+    def _run(self, interval, duration, stop_event):
+        deadline = _real_time.monotonic() + duration
+        own_id = _real_threading.get_ident()
+        while not stop_event.is_set() and _real_time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in _real_threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                if stop_event.is_set():
+                    break
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = [names.get(thread_id, f"thread-{thread_id}")]
+                    stack.extend(reversed(self._walk(frame)))
+                    key = ';'.join(stack)
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                self.samples += 1
+            del frames
+            stop_event.wait(interval)
+        with self._lock:
+            # Only a run that reached its duration is still current here
+            if self._stop_event is stop_event:
+                self._stop_event = None
+                self._running = False
+                self.stopped_at = time.time()
+
+    @staticmethod
+    def _walk(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return names
+
+    def collapsed(self):
+        """One ``frame;frame;... count`` line per distinct stack, root first"""
+        with self._lock:
+            counts = sorted(self._counts.items(), key=lambda item: -item[1])
+        return ''.join(f"{stack} {count}\n" for stack, count in counts)
+
+    def top(self, limit=20):
+        """Functions seen most often at the top of a stack"""
+        leaves = {}
+        with self._lock:
+            for stack, count in self._counts.items():
+                leaf = stack.rsplit(';', 1)[-1]
+                leaves[leaf] = leaves.get(leaf, 0) + count
+        ranked = sorted(leaves.items(), key=lambda item: -item[1])[:limit]
+        return [{'frame': frame, 'samples': count} for frame, count in ranked]
+
+    def stats(self):
+        with self._lock:
+            stacks = len(self._counts)
+        return {
+            'running': self._running,
+            'interval': self.interval,
+            'samples': self.samples,
+            'stacks': stacks,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at
+        }
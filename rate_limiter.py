@@ -0,0 +1,158 @@
+import collections
+import math
+import threading
+import time
+from log_pipeline import get_logger
+
+logger = get_logger('ratelimit')
+
+
+class TokenBucket:
+    """Allows ``rate`` messages per second on average and bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(1, burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        self.refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateShaper:
+    """Per-SIM token buckets with a hold queue for messages over the limit.
+
+    ``acquire`` takes a token for a message that can be published right
+    away. Messages that get no token are passed to ``hold`` and kept in a
+    FIFO queue per SIM; a background task hands them to ``release`` as
+    tokens become available. Once a SIM's queue reaches ``high_water``
+    messages, ``is_full`` reports it so the API can push back with 429.
+    """
+
+    def __init__(self, socketio, release, rate=1.0, burst=10, high_water=1000):
+        self.socketio = socketio
+        self.release = release
+        self.rate = rate
+        self.burst = burst
+        self.high_water = high_water
+        self._buckets = {}
+        self._queues = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self.held = 0
+        self.released = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return bool(self.rate)
+
+    def _bucket(self, sim_id):
+        bucket = self._buckets.get(sim_id)
+        if bucket is None:
+            bucket = self._buckets[sim_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def acquire(self, sim_id):
+        """Take a token for ``sim_id``; False means the message must be held"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            # Messages already waiting for this SIM go first
+            if self._queues.get(sim_id):
+                return False
+            return self._bucket(sim_id).take()
+
+    def hold(self, sim_id, message_id, topic):
+        with self._lock:
+            self._queues[sim_id].append((message_id, topic))
+            self.held += 1
+        self._wakeup.set()
+
+    def is_full(self, sim_id):
+        if not self.enabled or not self.high_water:
+            return False
+        with self._lock:
+            return len(self._queues.get(sim_id, ())) >= self.high_water
+
+    def retry_after(self, sim_ids):
+        """Seconds until one of ``sim_ids`` drops back below the high-water mark"""
+        with self._lock:
+            self.rejected += 1
+            waits = [
+                (len(self._queues.get(sim_id, ())) - self.high_water + 1) / self.rate
+                for sim_id in sim_ids
+            ]
+        return max(1, math.ceil(min(waits))) if waits else 1
+
+    def depth(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        if self._running or not self.enabled:
+            return
+        self._running = True
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def run(self):
+        while self._running:
+            try:
+                delay = self._release_ready()
+            except Exception as e:
+                logger.exception("Error releasing held messages: %s", e)
+                delay = 1
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def _release_ready(self):
+        """Release every held message that has a token; returns seconds until the next one"""
+        ready = []
+        delay = None
+        with self._lock:
+            for sim_id, queue in list(self._queues.items()):
+                bucket = self._bucket(sim_id)
+                while queue and bucket.take():
+                    ready.append(queue.popleft())
+                if queue:
+                    wait = bucket.wait_time()
+                    delay = wait if delay is None else min(delay, wait)
+                else:
+                    del self._queues[sim_id]
+            self.released += len(ready)
+        for message_id, topic in ready:
+            self.release(message_id, topic)
+        return delay
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'rate': self.rate,
+                'burst': self.burst,
+                'high_water': self.high_water,
+                'held': self.held,
+                'released': self.released,
+                'rejected': self.rejected,
+                'queued': {sim_id: len(queue) for sim_id, queue in self._queues.items()}
+            }
@@ -0,0 +1,214 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+import eventlet
+from sqlalchemy import tuple_
+from database import db, Log, SmsStatus
+from log_pipeline import get_logger
+
+logger = get_logger('retention')
+
+
+class RetentionPolicy:
+    """Limits for one table: keep at most ``max_rows`` rows and nothing older than ``max_age_days``.
+
+    Either limit may be ``None`` to disable it. ``model`` must have
+    ``timestamp`` and ``id`` columns; both limits evict oldest rows first.
+    """
+
+    def __init__(self, model, max_rows=None, max_age_days=None):
+        self.model = model
+        self.max_rows = max_rows
+        self.max_age_days = max_age_days
+
+    @property
+    def name(self):
+        return self.model.__tablename__
+
+
+class RetentionManager:
+    """Enforces retention policies in small batches from a background task.
+
+    Each batch selects the oldest evictable rows, optionally appends them to
+    a gzip-compressed NDJSON segment under ``archive_dir`` and deletes them
+    in its own short transaction, so the single writer is never held for
+    long. Segments are named ``<table>-<YYYY-MM-DD>.ndjson.gz``; every batch
+    is written as a separate gzip member, which ``gzip.open`` reads back as
+    one stream. After a run, freed pages are returned to the filesystem with
+    ``PRAGMA incremental_vacuum`` when the database uses incremental
+    auto-vacuum.
+    """
+
+    def __init__(self, app, socketio, policies, interval=300, batch_size=500,
+                 archive_dir=None, vacuum_pages=2000):
+        self.app = app
+        self.socketio = socketio
+        self.policies = policies
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive_dir = archive_dir
+        self.vacuum_pages = vacuum_pages
+        self._lock = threading.Lock()
+        self._running = False
+        self._stats = {
+            'runs': 0,
+            'deleted': {policy.name: 0 for policy in policies},
+            'archived': 0,
+            'vacuumed_pages': 0,
+            'last_run': None,
+            'last_run_ms': 0.0
+        }
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        while self._running:
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.exception("Error enforcing retention: %s", e)
+            eventlet.sleep(self.interval)
+
+    def enforce(self):
+        """Apply every policy once; returns the number of rows deleted per table"""
+        started = datetime.datetime.utcnow()
+        deleted = {}
+        with self.app.app_context():
+            for policy in self.policies:
+                deleted[policy.name] = self._enforce_policy(policy)
+            vacuumed = self._incremental_vacuum() if any(deleted.values()) else 0
+
+        elapsed_ms = (datetime.datetime.utcnow() - started).total_seconds() * 1000
+        with self._lock:
+            self._stats['runs'] += 1
+            for name, count in deleted.items():
+                self._stats['deleted'][name] += count
+            self._stats['vacuumed_pages'] += vacuumed
+            self._stats['last_run'] = int(started.timestamp())
+            self._stats['last_run_ms'] = round(elapsed_ms, 3)
+        if any(deleted.values()):
+            logger.info("Retention removed old rows", extra={'deleted': deleted, 'vacuumed_pages': vacuumed})
+        return deleted
+
+    def _eviction_filter(self, policy):
+        model = policy.model
+        key = tuple_(model.timestamp, model.id)
+        conditions = []
+        if policy.max_age_days is not None:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=policy.max_age_days)
+            conditions.append(model.timestamp < cutoff)
+        if policy.max_rows is not None:
+            # The newest row past the limit; it and everything older goes
+            boundary = (
+                db.session.query(model.timestamp, model.id)
+                .order_by(model.timestamp.desc(), model.id.desc())
+                .offset(policy.max_rows)
+                .first()
+            )
+            if boundary is not None:
+                conditions.append(key <= tuple_(*boundary))
+        if not conditions:
+            return None
+        return db.or_(*conditions)
+
+    def _enforce_policy(self, policy):
+        model = policy.model
+        condition = self._eviction_filter(policy)
+        db.session.rollback()
+        if condition is None:
+            return 0
+
+        deleted = 0
+        try:
+            while True:
+                rows = (
+                    model.query.filter(condition)
+                    .order_by(model.timestamp, model.id)
+                    .limit(self.batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                if self.archive_dir:
+                    self._archive(policy.name, rows)
+                db.session.execute(db.delete(model).where(model.id.in_([row.id for row in rows])))
+                db.session.commit()
+                deleted += len(rows)
+                if len(rows) < self.batch_size:
+                    break
+                # Give queued writers a turn between batches
+                eventlet.sleep(0)
+        finally:
+            # Hand the connection back; with a single writer nothing else can run until then
+            db.session.rollback()
+        return deleted
+
+    def _archive(self, table, rows):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        day = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        path = os.path.join(self.archive_dir, f"{table}-{day}.ndjson.gz")
+        lines = [json.dumps(self._serialize(row)) + '\n' for row in rows]
+        # Appending writes a new gzip member, so a crash never corrupts earlier batches
+        with gzip.open(path, 'at', encoding='utf-8') as segment:
+            segment.writelines(lines)
+        with self._lock:
+            self._stats['archived'] += len(rows)
+
+    @staticmethod
+    def _serialize(row):
+        record = {}
+        for column in row.__table__.columns:
+            value = getattr(row, column.key)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            record[column.key] = value
+        return record
+
+    def _incremental_vacuum(self):
+        if not self.vacuum_pages:
+            return 0
+        # Use the session's connection: with a single writer a second one waits out the pool timeout
+        connection = db.session.connection()
+        try:
+            if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+                return 0
+            before = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+            # sqlite3's execute() steps this pragma once, freeing a single
+            # page; executescript() runs it to completion
+            driver_connection = connection.connection.driver_connection
+            driver_connection.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})')
+            after = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+        finally:
+            db.session.rollback()
+        return before - after
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['deleted'] = dict(stats['deleted'])
+        return stats
+
+
+def build_policies(logging_config):
+    """Build the default policies from the ``Logging`` section of config.json"""
+    return [
+        RetentionPolicy(
+            Log,
+            max_rows=logging_config.get('max_logs', 1000),
+            max_age_days=logging_config.get('max_log_age_days')
+        ),
+        RetentionPolicy(
+            SmsStatus,
+            max_rows=logging_config.get('max_statuses'),
+            max_age_days=logging_config.get('max_status_age_days')
+        ),
+    ]
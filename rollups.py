@@ -0,0 +1,105 @@
+import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import db, MessageStat
+
+
+def bucket_for(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class RollupDeltas:
+    """Collects message_stat count changes to apply in the current transaction.
+
+    Callers record every inserted message and every status change, then
+    call ``apply`` before committing so the rollup stays in step with the
+    ``message`` table.
+    """
+
+    def __init__(self):
+        self._deltas = {}
+
+    def _add(self, timestamp, direction, sim_id, status, amount):
+        key = (bucket_for(timestamp or datetime.datetime.utcnow()), direction, sim_id or '', status or '')
+        self._deltas[key] = self._deltas.get(key, 0) + amount
+
+    def message_added(self, timestamp, direction, sim_id, status):
+        self._add(timestamp, direction, sim_id, status, 1)
+
+    def status_changed(self, timestamp, direction, sim_id, old_status, new_status):
+        if old_status == new_status:
+            return
+        self._add(timestamp, direction, sim_id, old_status, -1)
+        self._add(timestamp, direction, sim_id, new_status, 1)
+
+    def apply(self, session=None):
+        rows = [{
+            'bucket': bucket,
+            'direction': direction,
+            'sim_id': sim_id,
+            'status': status,
+            'count': count
+        } for (bucket, direction, sim_id, status), count in self._deltas.items() if count]
+        self._deltas = {}
+        if not rows:
+            return
+        table = MessageStat.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.bucket, table.c.direction, table.c.sim_id, table.c.status],
+            set_={'count': table.c.count + stmt.excluded['count']}
+        )
+        (session or db.session).execute(stmt, rows)
+
+
+def record_message(message):
+    """Count a single newly inserted message; call after flush, before commit"""
+    deltas = RollupDeltas()
+    deltas.message_added(message.timestamp, message.direction, message.sender_sim, message.status)
+    deltas.apply()
+
+
+def get_message_totals(since=None):
+    query = db.session.query(MessageStat.direction, db.func.sum(MessageStat.count))
+    if since is not None:
+        query = query.filter(MessageStat.bucket >= since)
+    return dict(query.group_by(MessageStat.direction).all())
+
+
+def get_messages_per_day(since):
+    rows = (
+        db.session.query(
+            db.func.date(MessageStat.bucket).label('date'),
+            db.func.sum(MessageStat.count).label('count')
+        )
+        .filter(MessageStat.bucket >= since)
+        .group_by(db.func.date(MessageStat.bucket))
+        .order_by(db.func.date(MessageStat.bucket))
+        .all()
+    )
+    return [{'date': row.date, 'count': row.count} for row in rows]
+
+
+def get_messages_per_sim(limit=5):
+    total = db.func.sum(MessageStat.count).label('message_count')
+    return (
+        db.session.query(MessageStat.sim_id, total)
+        .filter(MessageStat.sim_id != '')
+        .group_by(MessageStat.sim_id)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def get_status_totals():
+    """Message counts per direction and status, e.g. {'outgoing': {'sent': 3}}"""
+    rows = (
+        db.session.query(MessageStat.direction, MessageStat.status, db.func.sum(MessageStat.count))
+        .group_by(MessageStat.direction, MessageStat.status)
+        .all()
+    )
+    totals = {}
+    for direction, status, count in rows:
+        if count:
+            totals.setdefault(direction, {})[status] = count
+    return totals
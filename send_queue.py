@@ -0,0 +1,184 @@
+import json
+import eventlet
+from eventlet.queue import LightQueue, Empty
+from database import db, Message, SimCard
+from rollups import RollupDeltas
+from log_pipeline import get_logger
+
+logger = get_logger('dispatcher')
+
+
+_STOP = object()
+
+
+class SendDispatcher:
+    """Background dispatcher for messages accepted in async send mode.
+
+    ``send_sms`` stores the message with status ``queued`` and hands its id
+    to ``enqueue``. A green thread drains the queue, claims each batch by
+    moving it to ``sending`` and committing, publishes the whole batch to the
+    broker at once and then moves the acknowledged messages to ``pending``
+    and the rest to ``failed``. Rows still ``queued`` at
+    startup (e.g. after a crash) are picked up again by ``recover``, through
+    ``shaper`` when one is given so they respect the per-SIM rate limits.
+    Rows left in ``sending`` may already have been published and are not
+    sent again, so a crash never duplicates an SMS.
+    """
+
+    def __init__(self, app, publisher, socketio, events, batch_size=100, retry_delay=2, shaper=None):
+        self.app = app
+        self.publisher = publisher
+        self.shaper = shaper
+        self.socketio = socketio
+        self.events = events
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self._queue = LightQueue()
+        self._running = False
+        # Published or failed messages whose status commit failed, by new status
+        self._unconfirmed = {'pending': [], 'failed': []}
+
+    def enqueue(self, message_id, topic):
+        self._queue.put((message_id, topic))
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def recover(self):
+        """Re-enqueue messages left in ``queued`` state by a previous run."""
+        with self.app.app_context():
+            rows = (
+                db.session.query(Message.id, Message.sender_sim, SimCard.number)
+                .outerjoin(SimCard, SimCard.id == Message.sender_sim)
+                .filter(Message.direction == 'outgoing', Message.status == 'queued')
+                .order_by(Message.timestamp)
+                .all()
+            )
+            sending = Message.query.filter(Message.direction == 'outgoing', Message.status == 'sending').count()
+        for message_id, sim_id, number in rows:
+            # The original topic is not stored; route to the SIM chosen at enqueue time
+            topic = f"sms/send/{number.replace('+', '')}" if number else "sms/send"
+            if self.shaper is not None and self.shaper.enabled and sim_id:
+                self.shaper.hold(sim_id, message_id, topic)
+            else:
+                self.enqueue(message_id, topic)
+        if rows:
+            logger.info("Recovered %d queued messages", len(rows))
+        if sending:
+            logger.warning("%d messages were left in 'sending' and are not sent again", sending)
+
+    def start(self, recover=True):
+        if self._running:
+            return
+        self._running = True
+        if recover:
+            self.recover()
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+        # Wake the dispatcher if it is waiting for work
+        self._queue.put(_STOP)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return [item for item in batch if item is not _STOP]
+
+    def run(self):
+        while self._running:
+            try:
+                if any(self._unconfirmed.values()):
+                    eventlet.sleep(self.retry_delay)
+                    for status in self._unconfirmed:
+                        self._mark(status, [])
+                    continue
+                batch = self._next_batch()
+                if batch:
+                    self._publish(self._claim(batch))
+            except Exception as e:
+                logger.exception("Error dispatching queued messages: %s", e)
+                eventlet.sleep(self.retry_delay)
+
+    def _claim(self, batch):
+        """Move the batch from 'queued' to 'sending' and commit; returns the claimed messages"""
+        topics = dict(batch)
+        with self.app.app_context():
+            try:
+                rows = db.session.execute(
+                    db.update(Message)
+                    .where(Message.id.in_(list(topics)), Message.status == 'queued')
+                    .values(status='sending')
+                    .returning(Message.id, Message.recipient, Message.message, Message.timestamp, Message.sender_sim)
+                    .execution_options(synchronize_session=False)
+                ).all()
+                deltas = RollupDeltas()
+                for row in rows:
+                    deltas.status_changed(row.timestamp, 'outgoing', row.sender_sim, 'queued', 'sending')
+                deltas.apply()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Nothing was claimed; try the whole batch again
+                for item in batch:
+                    self.enqueue(*item)
+                raise
+        order = {message_id: index for index, (message_id, _) in enumerate(batch)}
+        return [{
+            'id': row.id,
+            'topic': topics[row.id],
+            'payload': json.dumps({'number': row.recipient, 'message': row.message, 'message_id': row.id})
+        } for row in sorted(rows, key=lambda row: order[row.id])]
+
+    def _publish(self, messages):
+        if not messages:
+            return
+        results = self.publisher.publish_many([(message['topic'], message['payload']) for message in messages], qos=1)
+        published, failed = [], []
+        for message, error in zip(messages, results):
+            if error is None:
+                published.append(message['id'])
+                continue
+            # An unacknowledged publish may still have reached the broker, so it is not retried
+            logger.error(
+                "Failed to publish queued message: %s", error,
+                extra={'message_id': message['id'], 'topic': message['topic']}
+            )
+            failed.append(message['id'])
+        try:
+            self._mark('pending', published)
+        finally:
+            self._mark('failed', failed)
+
+    def _mark(self, status, message_ids):
+        """Move published (``pending``) or failed messages on from 'sending' and commit"""
+        ids, self._unconfirmed[status] = self._unconfirmed[status] + message_ids, []
+        if not ids:
+            return
+        with self.app.app_context():
+            try:
+                # A status report may already have moved a message past 'sending'
+                rows = db.session.execute(
+                    db.update(Message)
+                    .where(Message.id.in_(ids), Message.status == 'sending')
+                    .values(status=status)
+                    .returning(Message.id, Message.timestamp, Message.sender_sim)
+                    .execution_options(synchronize_session=False)
+                ).all()
+                deltas = RollupDeltas()
+                for row in rows:
+                    deltas.status_changed(row.timestamp, 'outgoing', row.sender_sim, 'sending', status)
+                deltas.apply()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # The publishes are done; only their status is retried
+                self._unconfirmed[status] = ids
+                raise
+
+        for row in rows:
+            self.events.message({'id': row.id, 'message_id': row.id, 'status': status})
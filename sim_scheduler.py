@@ -0,0 +1,201 @@
+import itertools
+import threading
+import time
+import eventlet
+from database import SimCard
+from log_pipeline import get_logger
+
+logger = get_logger('scheduler')
+
+STRATEGIES = ('round_robin', 'least_inflight', 'weighted')
+
+# Status reports that mean the message is still on its way
+NON_FINAL_STATUSES = ('queued', 'sending', 'pending')
+
+
+def stored_weight(weight):
+    """Stored weight as a positive int; rows written before weights were validated fall back to 1"""
+    try:
+        return max(1, int(weight or 1))
+    except (TypeError, ValueError):
+        return 1
+
+
+class SimState:
+    __slots__ = ('id', 'number', 'weight', 'inflight', 'current_weight', 'assigned')
+
+    def __init__(self, sim_id, number, weight=1):
+        self.id = sim_id
+        self.number = number
+        self.weight = stored_weight(weight)
+        self.inflight = 0
+        self.current_weight = 0
+        self.assigned = 0
+
+
+class SimScheduler:
+    """Chooses the SIM card for messages that are not pinned to one.
+
+    Keeps the active SIM cards in memory, in sync with the ``/api/sim-cards``
+    endpoints through ``upsert``/``remove`` and with the database through a
+    periodic ``sync``. Strategies:
+
+    - ``round_robin``: each active SIM in turn
+    - ``least_inflight``: the SIM with the fewest messages awaiting a status
+      report, round-robin among ties
+    - ``weighted``: smooth weighted round-robin by ``SimCard.weight``
+
+    A message counts as in flight from ``assigned`` until the first final
+    status report for it arrives on ``/sms/status``, or until
+    ``inflight_timeout`` seconds pass without one.
+    """
+
+    def __init__(self, app, socketio, strategy='round_robin', inflight_timeout=300, sync_interval=60):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown SIM scheduling strategy: {strategy}")
+        self.app = app
+        self.socketio = socketio
+        self.strategy = strategy
+        self.inflight_timeout = inflight_timeout
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sims = {}
+        self._order = []
+        self._counter = itertools.count()
+        # message_id -> (sim_id, assigned_at)
+        self._inflight = {}
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.sync()
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        while self._running:
+            eventlet.sleep(self.sync_interval)
+            try:
+                self.sync()
+                self.expire()
+            except Exception as e:
+                logger.exception("Error syncing SIM scheduler: %s", e)
+
+    def sync(self):
+        """Reload the active SIM cards, keeping in-flight counts of known ones"""
+        with self.app.app_context():
+            sims = SimCard.query.filter_by(status='active').order_by(SimCard.id).all()
+            rows = [(sim.id, sim.number, sim.weight) for sim in sims]
+        with self._lock:
+            current = self._sims
+            self._sims = {}
+            for sim_id, number, weight in rows:
+                state = current.get(sim_id) or SimState(sim_id, number, weight)
+                state.number = number
+                state.weight = stored_weight(weight)
+                self._sims[sim_id] = state
+            self._order = list(self._sims)
+
+    def upsert(self, sim_card):
+        """Track changes made through the SIM card endpoints"""
+        if sim_card.status != 'active':
+            self.remove(sim_card.id)
+            return
+        with self._lock:
+            state = self._sims.get(sim_card.id)
+            if state is None:
+                state = self._sims[sim_card.id] = SimState(sim_card.id, sim_card.number, sim_card.weight)
+                self._order.append(sim_card.id)
+            state.number = sim_card.number
+            state.weight = stored_weight(sim_card.weight)
+
+    def remove(self, sim_id):
+        with self._lock:
+            if self._sims.pop(sim_id, None) is not None:
+                self._order.remove(sim_id)
+
+    def __len__(self):
+        return len(self._order)
+
+    def active_ids(self):
+        with self._lock:
+            return list(self._order)
+
+    def select(self):
+        """Return the id of the SIM card to use next, or ``None`` if none is active"""
+        with self._lock:
+            if not self._order:
+                return None
+            if self.strategy == 'weighted':
+                state = self._select_weighted()
+            else:
+                start = next(self._counter) % len(self._order)
+                candidates = self._order[start:] + self._order[:start]
+                if self.strategy == 'least_inflight':
+                    state = min((self._sims[sim_id] for sim_id in candidates), key=lambda s: s.inflight)
+                else:
+                    state = self._sims[candidates[0]]
+            return state.id
+
+    def _select_weighted(self):
+        # nginx's smooth weighted round-robin: spreads picks evenly over time
+        total = 0
+        best = None
+        for sim_id in self._order:
+            state = self._sims[sim_id]
+            state.current_weight += state.weight
+            total += state.weight
+            if best is None or state.current_weight > best.current_weight:
+                best = state
+        best.current_weight -= total
+        return best
+
+    def assigned(self, message_id, sim_id):
+        """Record a message sent (or queued) through ``sim_id``"""
+        with self._lock:
+            state = self._sims.get(sim_id)
+            if state is not None:
+                state.inflight += 1
+                state.assigned += 1
+            self._inflight[message_id] = (sim_id, time.monotonic())
+
+    def completed(self, message_id, status=None):
+        """Release a message once a final status is reported or its publish fails"""
+        if status in NON_FINAL_STATUSES:
+            return
+        with self._lock:
+            entry = self._inflight.pop(message_id, None)
+            if entry is not None:
+                self._release(entry[0])
+
+    def expire(self):
+        """Stop counting messages whose status report never arrived"""
+        deadline = time.monotonic() - self.inflight_timeout
+        with self._lock:
+            expired = [message_id for message_id, (_, at) in self._inflight.items() if at < deadline]
+            for message_id in expired:
+                self._release(self._inflight.pop(message_id)[0])
+        return len(expired)
+
+    def _release(self, sim_id):
+        state = self._sims.get(sim_id)
+        if state is not None and state.inflight > 0:
+            state.inflight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'strategy': self.strategy,
+                'inflight': len(self._inflight),
+                'sims': [{
+                    'id': state.id,
+                    'number': state.number,
+                    'weight': state.weight,
+                    'inflight': state.inflight,
+                    'assigned': state.assigned
+                } for state in (self._sims[sim_id] for sim_id in self._order)]
+            }
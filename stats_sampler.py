@@ -0,0 +1,69 @@
+import threading
+import time
+import eventlet
+from log_pipeline import get_logger
+
+logger = get_logger('stats')
+
+
+class StatisticsSampler:
+    """Computes the statistics snapshot on a fixed interval.
+
+    The latest snapshot is kept in memory for ``/api/statistics`` and pushed
+    to every dashboard with the ``statistics_update`` event, so the cost of
+    statistics does not grow with the number of viewers.
+    """
+
+    def __init__(self, app, socketio, compute, interval=15, event='statistics_update'):
+        self.app = app
+        self.socketio = socketio
+        self.compute = compute
+        self.interval = interval
+        self.event = event
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generated_at = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        while self._running:
+            try:
+                snapshot = self.refresh()
+                self.socketio.emit(self.event, self._with_age(snapshot, self._generated_at))
+            except Exception as e:
+                logger.exception("Error sampling statistics: %s", e)
+            eventlet.sleep(self.interval)
+
+    def refresh(self):
+        with self.app.app_context():
+            snapshot = self.compute()
+        with self._lock:
+            self._snapshot = snapshot
+            self._generated_at = time.time()
+        return snapshot
+
+    def latest(self):
+        """Return the cached snapshot with its age, computing it once if missing"""
+        with self._lock:
+            snapshot, generated_at = self._snapshot, self._generated_at
+        if snapshot is None:
+            snapshot = self.refresh()
+            generated_at = self._generated_at
+        return self._with_age(snapshot, generated_at)
+
+    @staticmethod
+    def _with_age(snapshot, generated_at):
+        return dict(
+            snapshot,
+            generated_at=generated_at,
+            age_seconds=round(time.time() - generated_at, 3)
+        )
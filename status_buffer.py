@@ -0,0 +1,248 @@
+import datetime
+import threading
+import time
+import uuid
+from sqlalchemy.dialects.sqlite import insert
+from database import db, is_transient_error, Message, SmsStatus
+from rollups import RollupDeltas
+from auth_cache import TTLCache
+from log_pipeline import get_logger
+
+logger = get_logger('status')
+
+# Delivery states in order; unknown states rank with 'sent'
+STATUS_RANK = {'queued': 0, 'sending': 1, 'pending': 1, 'sent': 2, 'delivered': 3, 'failed': 3}
+FINAL_STATUSES = ('delivered', 'failed')
+
+
+def advances(current, new):
+    """True if a report of ``new`` may replace ``current``; statuses only move forward"""
+    if current in FINAL_STATUSES:
+        return False
+    return STATUS_RANK.get(new, 2) >= STATUS_RANK.get(current, 0)
+
+
+class StatusBuffer:
+    """Write-behind buffer for delivery status messages from the broker.
+
+    ``add`` only appends to an in-memory list, so the MQTT network thread is
+    never blocked on the database. A background task flushes the buffer in
+    one transaction whenever ``max_batch`` items are waiting or
+    ``flush_interval_ms`` has elapsed, whichever comes first.
+
+    A report repeating a (message_id, status) pair seen in the last
+    ``dedupe_window`` seconds is dropped on arrival; older repeats are
+    dropped by the unique index on ``sms_status`` and do not touch the
+    message. A report never moves a message back to an earlier status.
+
+    A batch that fails because the database is busy goes back to the front
+    of the buffer. Any other failure falls back to writing the batch one
+    report at a time, so a single bad report cannot take the rest with it.
+    """
+
+    REQUIRED_FIELDS = ('sender_number', 'receiver_number', 'message', 'status')
+
+    def __init__(self, app, socketio, events, max_batch=100, flush_interval_ms=200,
+                 dedupe_window=600, dedupe_size=100000):
+        self.app = app
+        self.socketio = socketio
+        self.events = events
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.dedupe_window = dedupe_window
+        self._recent = TTLCache(dedupe_size)
+        self._items = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._stats = {
+            'buffered': 0,
+            'duplicates': 0,
+            'flushes': 0,
+            'flushed_items': 0,
+            'failed_flushes': 0,
+            'requeued': 0,
+            'rejected': 0,
+            'last_flush_size': 0,
+            'max_flush_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def add(self, data, payload):
+        missing = [field for field in self.REQUIRED_FIELDS if data.get(field) is None]
+        if missing:
+            logger.warning(
+                "Missing required fields in status message",
+                extra={'missing': missing, 'message_id': data.get('message_id'), 'sim': data.get('sender_number')}
+            )
+            return False
+        message_id = data.get('message_id')
+        if message_id and self.dedupe_window:
+            if not self._recent.add((message_id, data['status']), True, self.dedupe_window):
+                with self._lock:
+                    self._stats['duplicates'] += 1
+                return False
+        with self._lock:
+            self._items.append((data, datetime.datetime.utcnow()))
+            self._stats['buffered'] += 1
+            full = len(self._items) >= self.max_batch
+        if full:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Error flushing status buffer: %s", e)
+        self.flush()
+
+    def flush(self):
+        """Write all buffered status messages, normally in a single transaction."""
+        with self._lock:
+            items, self._items = self._items, []
+        if not items:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            results = [self._write(items)]
+        except Exception as e:
+            with self._lock:
+                self._stats['failed_flushes'] += 1
+            if is_transient_error(e):
+                self._requeue(items)
+                raise
+            logger.warning("Status batch failed, writing %d reports one at a time: %s", len(items), e)
+            results = self._write_each(items)
+
+        written = sum(len(status_rows) for _, status_rows, _ in results)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            stats = self._stats
+            stats['flushes'] += 1
+            stats['flushed_items'] += written
+            stats['last_flush_size'] = written
+            stats['max_flush_size'] = max(stats['max_flush_size'], written)
+            stats['last_flush_ms'] = round(elapsed_ms, 3)
+            stats['max_flush_ms'] = max(stats['max_flush_ms'], round(elapsed_ms, 3))
+            stats['total_flush_ms'] += elapsed_ms
+
+        unknown = set().union(*(missing for _, _, missing in results))
+        if unknown:
+            logger.warning("No message found for %d status updates", len(unknown))
+
+        for updated, status_rows, _ in results:
+            for message_id, status in updated.items():
+                self.events.message({'id': message_id, 'message_id': message_id, 'status': status})
+            for row in status_rows:
+                self.events.status(dict(row, timestamp=int(row['timestamp'].timestamp())))
+        return written
+
+    def _requeue(self, items):
+        """Put ``items`` back in front of anything buffered since they were taken"""
+        with self._lock:
+            self._items[:0] = items
+            self._stats['requeued'] += len(items)
+
+    def _write_each(self, items):
+        results = []
+        for index, item in enumerate(items):
+            try:
+                results.append(self._write([item]))
+            except Exception as e:
+                if is_transient_error(e):
+                    self._requeue(items[index:])
+                    break
+                data = item[0]
+                if data.get('message_id'):
+                    # Let a corrected resend of this report through the dedupe window
+                    self._recent.delete((data['message_id'], data['status']))
+                with self._lock:
+                    self._stats['rejected'] += 1
+                logger.error(
+                    "Dropped status report that cannot be stored: %s", e,
+                    extra={'message_id': data.get('message_id'), 'status': data.get('status')}
+                )
+        return results
+
+    def _write(self, items):
+        """Store ``items`` in one transaction.
+
+        Returns the new status per updated message, the ``sms_status`` rows inserted
+        and the message ids that were not found.
+        """
+        with self.app.app_context():
+            try:
+                status_rows = [{
+                    'id': str(uuid.uuid4()),
+                    'sender_number': data['sender_number'],
+                    'receiver_number': data['receiver_number'],
+                    'message': data['message'],
+                    'status': data['status'],
+                    'message_id': data.get('message_id'),
+                    'timestamp': received_at
+                } for data, received_at in items]
+                # Only the dedupe index may skip a row; other constraint failures still raise
+                inserted = set(db.session.scalars(
+                    insert(SmsStatus)
+                    .on_conflict_do_nothing(index_elements=['message_id', 'status'])
+                    .returning(SmsStatus.id),
+                    status_rows
+                ))
+                status_rows = [row for row in status_rows if row['id'] in inserted]
+
+                # The most advanced status wins when a message is reported more than once
+                latest = {}
+                for row in status_rows:
+                    message_id = row['message_id']
+                    if message_id and advances(latest.get(message_id), row['status']):
+                        latest[message_id] = row['status']
+
+                updated = {}
+                known_ids = set()
+                if latest:
+                    current = db.session.query(
+                        Message.id, Message.status, Message.timestamp, Message.direction, Message.sender_sim
+                    ).filter(Message.id.in_(list(latest))).all()
+                    known_ids = {row.id for row in current}
+                    current = [row for row in current if advances(row.status, latest[row.id])]
+                    updated = {row.id: latest[row.id] for row in current}
+                    if current:
+                        db.session.execute(db.update(Message), [
+                            {'id': message_id, 'status': status} for message_id, status in updated.items()
+                        ])
+                        deltas = RollupDeltas()
+                        for row in current:
+                            deltas.status_changed(row.timestamp, row.direction, row.sender_sim, row.status, latest[row.id])
+                        deltas.apply()
+
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return updated, status_rows, set(latest) - known_ids
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._items)
+        flushes = stats['flushes']
+        stats['avg_flush_size'] = round(stats['flushed_items'] / flushes, 2) if flushes else 0
+        stats['avg_flush_ms'] = round(stats.pop('total_flush_ms') / flushes, 3) if flushes else 0.0
+        return stats
@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, configure_storage, run_migrations, Message, MIGRATIONS, SmsStatus  # noqa: E402
+from pagination import paginate  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """A database created without secondary indexes, as before the migrations, then migrated"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'gateway.db'}"
+    configure_storage(app, {'single_writer': False})
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            indexes = connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            ).scalars().all()
+            for name in indexes:
+                connection.exec_driver_sql(f'DROP INDEX {name}')
+            connection.exec_driver_sql('PRAGMA user_version = 0')
+        run_migrations()
+        yield app
+        db.session.remove()
+
+
+def query_plan(run):
+    """``EXPLAIN QUERY PLAN`` details of the last statement executed by ``run``"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    statement, parameters = statements[-1]
+    rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [row[3] for row in rows]
+
+
+def assert_uses_index(plan, index):
+    assert any(f'USING INDEX {index}' in step or f'USING COVERING INDEX {index}' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') for step in plan), plan
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+@pytest.mark.parametrize('direction', ['incoming', 'outgoing'])
+def test_message_list_uses_direction_index(app, direction):
+    with app.app_context():
+        plan = query_plan(lambda: paginate(
+            Message.query.filter_by(direction=direction), Message.timestamp, Message.id, {'limit': '50'}
+        ))
+    assert_uses_index(plan, 'ix_message_direction_timestamp')
+
+
+def test_status_lookup_by_message_id_uses_index(app):
+    with app.app_context():
+        plan = query_plan(lambda: SmsStatus.query.filter_by(message_id='message-1').all())
+    assert_uses_index(plan, 'uq_sms_status_message_status')
+
+
+def test_migrations_record_schema_version(app):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+    assert version == MIGRATIONS[-1][0]
@@ -0,0 +1,118 @@
+import datetime
+import gzip
+import json
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, configure_storage, register_sqlite_pragmas, Log, SmsStatus  # noqa: E402
+from retention import RetentionManager, RetentionPolicy  # noqa: E402
+
+NOW = datetime.datetime.utcnow()
+
+
+@pytest.fixture
+def app(tmp_path):
+    """A fresh database with the default single writer profile and a short pool timeout"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'gateway.db'}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_timeout': 2}
+    configure_storage(app)
+    db.init_app(app)
+    with app.app_context():
+        register_sqlite_pragmas(app)
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def add_logs(count, age=datetime.timedelta(0), details=''):
+    for index in range(count):
+        db.session.add(Log(
+            id=f'log-{index:04d}', action='send_sms', details=details,
+            timestamp=NOW - age - datetime.timedelta(seconds=count - index)
+        ))
+    db.session.commit()
+
+
+def add_status(status_id, age):
+    db.session.add(SmsStatus(
+        id=status_id, sender_number='+15550001', receiver_number='+15550002',
+        message='hi', status='sent', timestamp=NOW - age
+    ))
+    db.session.commit()
+
+
+def remaining_ids(model):
+    return [row.id for row in model.query.order_by(model.timestamp, model.id)]
+
+
+def test_single_writer_run_completes_and_vacuums(app):
+    with app.app_context():
+        add_logs(30, details='x' * 4000)
+        add_status('recent', datetime.timedelta(days=1))
+        manager = RetentionManager(app, None, [
+            RetentionPolicy(Log, max_rows=10),
+            RetentionPolicy(SmsStatus, max_age_days=30),
+        ])
+
+        assert manager.enforce() == {'log': 20, 'sms_status': 0}
+        assert remaining_ids(SmsStatus) == ['recent']
+
+    stats = manager.stats()
+    assert stats['runs'] == 1
+    assert stats['deleted'] == {'log': 20, 'sms_status': 0}
+    assert stats['vacuumed_pages'] > 0
+
+
+def test_row_count_keeps_newest_rows(app):
+    with app.app_context():
+        add_logs(12)
+        manager = RetentionManager(app, None, [RetentionPolicy(Log, max_rows=5)], batch_size=4)
+
+        assert manager.enforce() == {'log': 7}
+        assert remaining_ids(Log) == [f'log-{index:04d}' for index in range(7, 12)]
+
+
+def test_age_evicts_only_expired_rows(app):
+    with app.app_context():
+        add_status('expired', datetime.timedelta(days=31))
+        add_status('kept', datetime.timedelta(days=29))
+        manager = RetentionManager(app, None, [RetentionPolicy(SmsStatus, max_age_days=30)])
+
+        assert manager.enforce() == {'sms_status': 1}
+        assert remaining_ids(SmsStatus) == ['kept']
+
+
+def test_row_count_breaks_timestamp_ties_by_id(app):
+    with app.app_context():
+        for log_id in ['c', 'a', 'e', 'b', 'd']:
+            db.session.add(Log(id=log_id, action='send_sms', timestamp=NOW))
+        db.session.commit()
+        manager = RetentionManager(app, None, [RetentionPolicy(Log, max_rows=2)])
+
+        assert manager.enforce() == {'log': 3}
+        assert remaining_ids(Log) == ['d', 'e']
+
+
+def test_archive_appends_gzip_members(app, tmp_path):
+    archive_dir = tmp_path / 'archive'
+    with app.app_context():
+        add_logs(5)
+        manager = RetentionManager(
+            app, None, [RetentionPolicy(Log, max_rows=1)], batch_size=2, archive_dir=str(archive_dir)
+        )
+        manager.enforce()
+        add_logs(2, age=datetime.timedelta(days=1))
+        manager.enforce()
+
+    segments = os.listdir(archive_dir)
+    assert segments == [f"log-{datetime.datetime.utcnow():%Y-%m-%d}.ndjson.gz"]
+    with gzip.open(archive_dir / segments[0], 'rt', encoding='utf-8') as segment:
+        archived = [json.loads(line)['id'] for line in segment]
+    assert archived == ['log-0000', 'log-0001', 'log-0002', 'log-0003', 'log-0000', 'log-0001']
+    assert manager.stats()['archived'] == 6
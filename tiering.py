@@ -0,0 +1,208 @@
+import datetime
+import os
+import threading
+import eventlet
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from database import db, Message, MessageArchive
+from pagination import paginate, page_limit, parse_time, decode_cursor, encode_cursor
+from log_pipeline import get_logger
+
+logger = get_logger('archive')
+
+
+class MessageArchiver:
+    """Moves old messages into per-month archive databases and reads across tiers.
+
+    Messages older than ``max_age_days`` are copied to
+    ``<archive_dir>/messages-YYYY-MM.db`` and then deleted from the hot
+    database, one batch per transaction. The ``message_archive`` table
+    records the time range of every archive file, so ``paginate`` only
+    opens the files a request's time range and page position can reach.
+    Archive files are opened read-only for queries.
+    """
+
+    def __init__(self, app, socketio, archive_dir, max_age_days=90, interval=3600, batch_size=1000):
+        self.app = app
+        self.socketio = socketio
+        self.archive_dir = archive_dir
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._engines = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._stats = {'runs': 0, 'archived': 0, 'tier_reads': 0, 'last_run': None}
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        while self._running:
+            try:
+                self.archive_old_messages()
+            except Exception as e:
+                logger.exception("Error archiving messages: %s", e)
+            eventlet.sleep(self.interval)
+
+    def _engine(self, path, read_only=True):
+        key = (path, read_only)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                if read_only:
+                    engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+                else:
+                    engine = create_engine(f"sqlite:///{path}")
+                self._engines[key] = engine
+        return engine
+
+    def _archive_path(self, month):
+        return os.path.join(self.archive_dir, f"messages-{month}.db")
+
+    def archive_old_messages(self):
+        """Move every message older than ``max_age_days`` to its month's archive"""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.max_age_days)
+        moved = 0
+        with self.app.app_context():
+            while True:
+                rows = (
+                    Message.query.filter(Message.timestamp < cutoff)
+                    .order_by(Message.timestamp, Message.id)
+                    .limit(self.batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                try:
+                    self._move(rows)
+                except Exception:
+                    db.session.rollback()
+                    raise
+                moved += len(rows)
+                if len(rows) < self.batch_size:
+                    break
+                # Give queued writers a turn between batches
+                eventlet.sleep(0)
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['archived'] += moved
+            self._stats['last_run'] = int(datetime.datetime.utcnow().timestamp())
+        if moved:
+            logger.info("Archived old messages", extra={'moved': moved, 'cutoff': cutoff.isoformat()})
+        return moved
+
+    def _move(self, rows):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row.timestamp.strftime('%Y-%m'), []).append(row)
+
+        columns = [column.key for column in Message.__table__.columns]
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, month_rows in by_month.items():
+            path = self._archive_path(month)
+            engine = self._engine(path, read_only=False)
+            Message.__table__.create(engine, checkfirst=True)
+            # The archive copy commits first; a crash before the hot delete
+            # leaves a duplicate that the next run replaces
+            with engine.begin() as connection:
+                connection.execute(
+                    Message.__table__.insert().prefix_with('OR REPLACE'),
+                    [{name: getattr(row, name) for name in columns} for row in month_rows]
+                )
+                count, min_timestamp, max_timestamp = connection.execute(
+                    db.select(db.func.count(), db.func.min(Message.timestamp), db.func.max(Message.timestamp))
+                ).one()
+
+            tier = db.session.get(MessageArchive, month) or MessageArchive(month=month)
+            tier.path = path
+            tier.row_count = count
+            tier.min_timestamp = min_timestamp
+            tier.max_timestamp = max_timestamp
+            db.session.add(tier)
+
+        db.session.execute(db.delete(Message).where(Message.id.in_([row.id for row in rows])))
+        db.session.commit()
+
+    def _tiers_for(self, args):
+        """Archive tiers overlapping the requested time range"""
+        query = MessageArchive.query
+        if args.get('since'):
+            query = query.filter(MessageArchive.max_timestamp >= parse_time(args['since']))
+        if args.get('until'):
+            query = query.filter(MessageArchive.min_timestamp < parse_time(args['until']))
+        return query.all()
+
+    def paginate(self, build_query, args, filters=None):
+        """Keyset-paginate messages across the hot database and archive tiers.
+
+        ``build_query`` is called with a session and returns the base message
+        query for it. Takes the same arguments and returns the same
+        ``(rows, next_cursor, total)`` as ``pagination.paginate``.
+        """
+        limit = page_limit(args)
+        descending = args.get('sort', 'desc').lower() != 'asc'
+        counting = args.get('count', '').lower() in ('1', 'true', 'yes')
+
+        rows, next_cursor, total = paginate(
+            build_query(db.session), Message.timestamp, Message.id, args, filters=filters
+        )
+        tiers = self._tiers_for(args)
+        # Counting needs every tier in range; otherwise skip tiers that hold
+        # nothing past the cursor or nothing ranking ahead of a full hot page
+        if not counting:
+            if args.get('before'):
+                bound = decode_cursor(args['before'])[0]
+                tiers = [tier for tier in tiers if tier.min_timestamp <= bound]
+            if args.get('after'):
+                bound = decode_cursor(args['after'])[0]
+                tiers = [tier for tier in tiers if tier.max_timestamp >= bound]
+            if len(rows) == limit:
+                last = rows[-1].timestamp
+                if descending:
+                    tiers = [tier for tier in tiers if tier.max_timestamp >= last]
+                else:
+                    tiers = [tier for tier in tiers if tier.min_timestamp <= last]
+        if not tiers:
+            return rows, next_cursor, total
+
+        has_more = next_cursor is not None
+        merged = {row.id: row for row in rows}
+        for tier in tiers:
+            if not os.path.exists(tier.path):
+                logger.warning("Archive tier is missing", extra={'month': tier.month, 'path': tier.path})
+                continue
+            with Session(self._engine(tier.path)) as session:
+                tier_rows, tier_cursor, tier_total = paginate(
+                    build_query(session), Message.timestamp, Message.id, args, filters=filters
+                )
+                session.expunge_all()
+            has_more = has_more or tier_cursor is not None
+            if tier_total is not None:
+                total += tier_total
+            for row in tier_rows:
+                merged.setdefault(row.id, row)
+        with self._lock:
+            self._stats['tier_reads'] += len(tiers)
+
+        ordered = sorted(merged.values(), key=lambda row: (row.timestamp, row.id), reverse=descending)
+        if limit is not None and len(ordered) > limit:
+            has_more = True
+            ordered = ordered[:limit]
+        next_cursor = None
+        if has_more and ordered:
+            next_cursor = encode_cursor(ordered[-1].timestamp, ordered[-1].id)
+        return ordered, next_cursor, total
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['tiers'] = MessageArchive.query.count()
+        return stats